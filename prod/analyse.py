@@ -0,0 +1,200 @@
+# offline batch analysis of recorded compliance test traces
+# every trace is run through calcCompliance (lib/compliance.py, via the same segmenter as testCompliance) and the
+# legacy framed getCompliance (tests/compliance_test.py) in a process pool, results are written to a table as
+# they arrive, followed by per-object statistics
+# traces are memory-mapped and streamed in chunks, so they can be larger than memory
+# usage: python3 analyse.py [--output results.csv] [--workers N] traces_or_directories [...]
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from lib.compliance import calcCompliance
+from lib.segmenter import CollisionSegmenter, FrameSegmenter
+from lib.stats import RunningStats, StableEstimate
+from lib.trace import Trace
+from compliance_test import frame_size, getCompliance
+
+CHUNK_SIZE = 1 << 16  # samples per chunk
+
+COLUMNS = ["path", "class_name", "samples", "test_samples", "c_mean", "c_error", "recorded", "compliance",
+           "legacy_compliance", "accel_events", "decel_events", "legacy_decel_events", "seconds"]
+
+
+def findTraces(paths):
+    # trace files in paths, directories are searched recursively
+    traces = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                traces.extend(os.path.join(directory, name) for name in names if name.endswith(".trace"))
+        else:
+            traces.append(path)
+    return sorted(traces)
+
+
+def testWindow(trace, test_duration):
+    # (start, end) sample indices of the compliance test: from the first forward motor target to test_duration later
+    # or the next motor target, whole trace if no motor targets were recorded
+    t = trace.stream("accel")["t"]
+    motor = trace.stream("motor")
+
+    forward = np.flatnonzero((motor["values"] > 0).all(axis=1)) if len(motor["t"]) > 0 else []
+    if len(forward) == 0:
+        return 0, len(t)
+
+    start_time = motor["t"][forward[0]]
+    end_time = start_time + test_duration
+    if forward[0] + 1 < len(motor["t"]):
+        end_time = min(end_time, motor["t"][forward[0] + 1])
+
+    return int(np.searchsorted(t, start_time)), int(np.searchsorted(t, end_time, side="right"))
+
+
+def chunks(x, start, end):
+    # consecutive views of x[start:end]
+    for chunk_start in range(start, end, CHUNK_SIZE):
+        yield x[chunk_start:min(chunk_start + CHUNK_SIZE, end)]
+
+
+def traceCalibration(trace, start):
+    # (average, error range) as recorded by testCompliance, or estimated from the samples before the test
+    c_mean, c_error = trace.meta.get("c_mean"), trace.meta.get("c_error")
+    if c_mean is None or c_error is None:
+        estimate = StableEstimate()
+        for chunk in chunks(trace.stream("accel")["x"], 0, start):
+            estimate.updateMany(chunk)
+        c_mean, c_error = estimate.mean, estimate.halfRange
+    return c_mean, c_error
+
+
+def analyseTrace(path, test_duration=2, settle_samples=25):
+    # both compliance algorithms on one trace, as a row of COLUMNS
+    started = time.perf_counter()
+    trace = Trace(path)
+    x = trace.stream("accel")["x"]
+    start, end = testWindow(trace, test_duration)
+    c_mean, c_error = traceCalibration(trace, start)
+
+    # calcCompliance, segmented like testCompliance (stops at the first closed collision decel event)
+    segmenter = CollisionSegmenter(2 * (c_error - c_mean), settle_samples=settle_samples)
+    for chunk in chunks(x, start, end):
+        if any(segmenter.update(value) for value in (chunk.astype(float) - c_mean).tolist()):
+            break
+    segmenter.close()
+    compliance = calcCompliance(segmenter.accel_events, segmenter.decel_events)
+
+    # legacy framed analysis (analyseFrames), its rolling window carries over from one chunk to the next
+    frames = FrameSegmenter(round(c_error - c_mean, 2), frame_size)
+    for chunk in chunks(x, start, end):
+        for value in (chunk.astype(float) - c_mean).tolist():
+            frames.update(value)
+    frames.close()
+    decel_events = frames.decel_events
+    legacy_compliance = getCompliance(decel_events)
+
+    return {"path": path,
+            "class_name": trace.meta.get("class_name", "unknown"),
+            "samples": len(x),
+            "test_samples": end - start,
+            "c_mean": c_mean,
+            "c_error": c_error,
+            "recorded": trace.meta.get("compliance"),
+            "compliance": compliance,
+            "legacy_compliance": legacy_compliance,
+            "accel_events": len(segmenter.accel_events),
+            "decel_events": len(segmenter.decel_events),
+            "legacy_decel_events": len(decel_events),
+            "seconds": time.perf_counter() - started}
+
+
+class TableWriter:
+    # writes rows to csv as they arrive, or collects them for a parquet file written on close
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.parquet = path.endswith(".parquet")
+        self.rows = []
+        if not self.parquet:
+            self.file = open(path, "w", newline="")
+            self.writer = csv.DictWriter(self.file, columns)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.parquet:
+            self.rows.append(row)
+        else:
+            self.writer.writerow(row)
+            self.file.flush()
+
+    def close(self):
+        if self.parquet:
+            # optional dependency, only needed for parquet output
+            import pyarrow
+            import pyarrow.parquet
+
+            table = pyarrow.table({column: [row[column] for row in self.rows] for column in self.columns})
+            pyarrow.parquet.write_table(table, self.path)
+        else:
+            self.file.close()
+
+
+def objectStatistics(rows):
+    # per class RunningStats of both algorithms
+    stats = {}
+    for row in rows:
+        compliance, legacy = stats.setdefault(row["class_name"], (RunningStats(), RunningStats()))
+        compliance.update(row["compliance"])
+        legacy.update(row["legacy_compliance"])
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="analyse recorded compliance test traces in parallel")
+    parser.add_argument("traces", nargs="+", help="trace files or directories of trace files")
+    parser.add_argument("--output", default="analysis.csv", help="per trace results (.csv or .parquet)")
+    parser.add_argument("--objects", default=None, help="per object statistics (default: OUTPUT_objects.csv)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--test-duration", type=float, default=2, help="compliance test duration (seconds)")
+    parser.add_argument("--settle-samples", type=int, default=25, help="quiet samples that end a decel event")
+    args = parser.parse_args()
+
+    paths = findTraces(args.traces)
+    if len(paths) == 0:
+        parser.error("no traces found")
+
+    objects_path = args.objects or os.path.splitext(args.output)[0] + "_objects.csv"
+    start = time.perf_counter()
+    rows = []
+
+    table = TableWriter(args.output, COLUMNS)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # results are written in completion order as soon as they arrive
+        futures = [pool.submit(analyseTrace, path, args.test_duration, args.settle_samples) for path in paths]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            table.write(row)
+    table.close()
+
+    stats = objectStatistics(rows)
+    with open(objects_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["class_name", "traces", "mean", "std", "min", "max",
+                         "legacy_mean", "legacy_std", "legacy_min", "legacy_max"])
+        for class_name, (compliance, legacy) in sorted(stats.items()):
+            writer.writerow([class_name, compliance.count, compliance.mean, compliance.std, compliance.min,
+                             compliance.max, legacy.mean, legacy.std, legacy.min, legacy.max])
+            print("{}: {} traces, compliance {:.3f} +- {:.3f}, legacy {:.3f} +- {:.3f}".format(
+                class_name, compliance.count, compliance.mean, compliance.std, legacy.mean, legacy.std))
+
+    elapsed = time.perf_counter() - start
+    print("analysed {} traces ({} samples) in {:.2f}s, results in {} and {}".format(
+        len(rows), sum(row["samples"] for row in rows), elapsed, args.output, objects_path))
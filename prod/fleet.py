@@ -0,0 +1,140 @@
+# run several ThymPi robots from one host
+# every robot gets its own worker process (own Aseba node, IMU and camera), all of them share one compliance
+# knowledge base that lives in this process, so a compliance measured by one robot is known to all of them at once
+# usage: python3 fleet.py --robot thymio-1:0x68:0 --robot thymio-2:0x69:1
+#        python3 fleet.py --fake 8 --encounters 20 --speedup 4
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+
+from lib.store import ComplianceStore
+
+
+class FleetManager(SyncManager):
+    # serves the shared ComplianceStore, workers get proxies that call into this process
+    pass
+
+
+FleetManager.register("ComplianceStore", ComplianceStore,
+                      exposed=("__getitem__", "__setitem__", "__contains__", "__iter__", "get", "summary", "history",
+                               "flush", "close"),
+                      method_to_typeid={"__iter__": "Iterator"})
+
+
+def parseRobot(spec):
+    # NODE[:IMU_ADDRESS[:CAMERA]], e.g. thymio-2:0x69:1
+    parts = spec.split(":")
+    node = parts[0]
+    imu_address = int(parts[1], 0) if len(parts) > 1 and parts[1] != "" else 0x68
+    camera = int(parts[2]) if len(parts) > 2 and parts[2] != "" else 0
+    return node, imu_address, camera
+
+
+def runRobot(index, node, imu_address, camera, compliances, fake=False, encounters=None, speedup=1.0, retest=False):
+    # worker process: one robot's control loop, returns its summary
+    from lib.camera import FrameGrabber
+    from main import ThymPi, run
+
+    on_encounter = None
+    if fake:
+        from lib.fakes import DEFAULT_OBSTACLES, FakeWorld
+
+        # every simulated robot meets the obstacles in a different order
+        shift = index % len(DEFAULT_OBSTACLES)
+        world = FakeWorld(DEFAULT_OBSTACLES[shift:] + DEFAULT_OBSTACLES[:shift], speedup=speedup, seed=index)
+        devices, cap = world.devices()
+        thympi = ThymPi(verbose=False, compliances=compliances, node=node, **devices)
+        on_encounter = lambda name: world.nextObstacle()
+    else:
+        import cv2
+
+        thympi = ThymPi(verbose=False, compliances=compliances, node=node, imu_address=imu_address)
+        cap = cv2.VideoCapture(camera)
+        cap.set(3, 640)
+        cap.set(4, 480)
+
+    # per robot metrics files
+    thympi.metrics_path = os.path.join(thympi.bin_path, "metrics-{}.prom".format(node))
+    thympi.metrics_summary_path = os.path.join(thympi.bin_path, "metrics-{}.json".format(node))
+
+    grabber = FrameGrabber(cap, thympi.metrics)
+    grabber.start()
+
+    start = time.perf_counter()
+    try:
+        handled = run(thympi, grabber, encounters, retest, on_encounter)
+    finally:
+        thympi.setSpeed(0, 0)
+        thympi.motor.stop()
+        grabber.stop()
+    elapsed = time.perf_counter() - start
+
+    return {"node": node,
+            "encounters": len(handled),
+            "tests": thympi.metrics.summary().get("compliance_tests_total", 0),
+            "elapsed": elapsed,
+            "latencies": [duration for name, duration in handled]}
+
+
+def runFleet(robots, compliances, fake=False, encounters=None, speedup=1.0, retest=False):
+    # run every (node, imu_address, camera) robot in its own process, returns their summaries
+    # spawned workers don't inherit this process's threads (the manager, DBus loops)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(robots), mp_context=context) as pool:
+        futures = [pool.submit(runRobot, index, node, imu_address, camera, compliances, fake, encounters, speedup,
+                               retest)
+                   for index, (node, imu_address, camera) in enumerate(robots)]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a fleet of ThymPi robots with shared compliance knowledge")
+    parser.add_argument("--robot", action="append", default=[], metavar="NODE[:IMU_ADDRESS[:CAMERA]]",
+                        help="a robot to run, can be repeated")
+    parser.add_argument("--fake", type=int, default=0, metavar="N", help="run N simulated robots (lib/fakes.py)")
+    parser.add_argument("--encounters", type=int, default=None, help="stop each robot after this many obstacles")
+    parser.add_argument("--speedup", type=float, default=1.0, help="simulated world speed with --fake")
+    parser.add_argument("--retest", action="store_true", help="retest objects with a known compliance")
+    parser.add_argument("--db", default=None,
+                        help="compliance database (default bin/compliances.db, in memory with --fake)")
+    args = parser.parse_args()
+
+    if args.fake > 0:
+        robots = [("thymio-{}".format(index + 1), 0x68, 0) for index in range(args.fake)]
+        db = args.db or ":memory:"
+    else:
+        robots = [parseRobot(spec) for spec in args.robot]
+        db = args.db or os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin", "compliances.db")
+    if len(robots) == 0:
+        parser.error("no robots, use --robot or --fake")
+
+    with FleetManager() as manager:
+        compliances = manager.ComplianceStore(db)
+
+        start = time.perf_counter()
+        try:
+            summaries = runFleet(robots, compliances, args.fake > 0, args.encounters, args.speedup, args.retest)
+        finally:
+            # the manager process exits without running atexit handlers, commit queued measurements here
+            compliances.close()
+        elapsed = time.perf_counter() - start
+
+        for summary in summaries:
+            latencies = sorted(summary["latencies"])
+            print("{}: {} obstacles ({} tested) in {:.2f}s, {:.2f} per minute, median latency {}".format(
+                summary["node"], summary["encounters"], summary["tests"], summary["elapsed"],
+                60 * summary["encounters"] / summary["elapsed"],
+                "{:.2f}s".format(latencies[len(latencies) // 2]) if len(latencies) > 0 else "-"))
+
+        total = sum(summary["encounters"] for summary in summaries)
+        tests = sum(summary["tests"] for summary in summaries)
+        print("fleet: {} robots handled {} obstacles ({} tested) in {:.2f}s ({:.2f} per minute)".format(
+            len(summaries), total, tests, elapsed, 60 * total / elapsed))
+
+        print("known compliances:")
+        for class_name in compliances:
+            print("class: {} | compliance: {}".format(class_name, compliances[class_name]))
@@ -0,0 +1,81 @@
+# latest-frame camera capture
+# a thread keeps reading from the capture device so readers only ever get the newest frame,
+# instead of whatever cv2.VideoCapture buffered while the robot was busy
+
+import threading
+import time
+
+
+class FrameGrabber:
+    def __init__(self, cap, metrics=None):
+        self.cap = cap
+        self.metrics = metrics  # lib.metrics.Metrics to time reads with (None to disable)
+        self.frame = None
+        self.timestamp = None  # time.perf_counter() when the frame was read
+        self.frames = 0  # frames read since start
+        self.failures = 0  # failed reads since start
+        self.new_frame = threading.Condition()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="frame-grabber", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        histogram = None
+        if self.metrics is not None:
+            histogram = self.metrics.histogram("camera_read_seconds", "camera read time in seconds")
+
+        while not self.stopped.is_set():
+            start = time.perf_counter()
+            success, frame = self.cap.read()
+            timestamp = time.perf_counter()
+            if histogram is not None:
+                histogram.observe(timestamp - start)
+
+            if not success:
+                self.failures += 1
+                if self.metrics is not None:
+                    self.metrics.counter("camera_failures_total", "failed camera reads").inc()
+                self.stopped.wait(0.01)
+                continue
+
+            with self.new_frame:
+                self.frame = frame
+                self.timestamp = timestamp
+                self.frames += 1
+                self.new_frame.notify_all()
+
+    def read(self):
+        # newest frame as (success, frame, timestamp), never waits
+        with self.new_frame:
+            return self.frame is not None, self.frame, self.timestamp
+
+    def wait(self, after, timeout=1.0):
+        # first frame captured after time.perf_counter() value after, as (success, frame, timestamp)
+        # success is False if no such frame arrived within timeout seconds
+        with self.new_frame:
+            self.new_frame.wait_for(lambda: self.timestamp is not None and self.timestamp > after, timeout)
+            if self.timestamp is None or self.timestamp <= after:
+                return False, None, None
+            return True, self.frame, self.timestamp
+
+    def burst(self, count, after, timeout=1.0):
+        # count consecutive frames captured after time.perf_counter() value after, as (frames, last timestamp)
+        # stops early if a frame doesn't arrive within timeout seconds, so fewer frames may be returned
+        frames = []
+        while len(frames) < count:
+            success, frame, timestamp = self.wait(after, timeout)
+            if not success:
+                break
+            frames.append(frame)
+            after = timestamp
+        return frames, after
@@ -1,68 +1,123 @@
 # functions used to calculate obstacle compliance based on sensor data
+# events are handled as numpy arrays, every decel event of a test is scored in one vectorized pass
+
+import numpy as np
 
 # globals
 verbose = True
 
+# weights used by wAvg, indexed by the relative position of a value in its (sorted) event
+weights = np.array([5, 2, 1, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2, 0.1])
+
+# 5 is a placeholder, this can be changed based on what kind of values wAvg gives out
+maxWavg = 5
+
+# cache of per-position weights, keyed by event length
+_weight_positions = {}
+
 
 def getAbs(_list):
     # convert _list items to their absolute value
-    abs_list = []
-    for elem in _list:
-        abs_list.append(abs(elem))
-    return abs_list
+    return np.abs(np.asarray(_list, dtype=float))
 
 
 def get2Dsize(_list):
     # use absolute values
     abs_list = getAbs(_list)
-    size = max(abs_list) * len(abs_list)  # could be changed in the future
+    size = abs_list.max() * abs_list.size  # could be changed in the future
     return size
 
 
-def calcCompliance(accel_events, decel_events):
-    # calculate compliance using accel and decel events
+def weightPositions(n):
+    # weight applied to each position of an n long event, computed once per length
+    # position i maps to weights[round(i / n * len(weights))], clipped to the last weight
+    if n not in _weight_positions:
+        index = np.rint(np.arange(n) / n * len(weights)).astype(int)
+        _weight_positions[n] = weights[np.minimum(index, len(weights) - 1)]
+    return _weight_positions[n]
 
-    # NOTE: accel_events is currently redundant
 
-    # select largest event (by get2DSize())
-    max_size = 0
-    for event in decel_events:
-        if get2Dsize(event) >= max_size:
-            max_event = event
+def wAvg(_list):
+    # weighted average to calculate compliance based on deceleration values
+    # weights are picked by position, so repeated values no longer share the weight of their first occurrence
+    values = np.asarray(_list, dtype=float)
 
-    # get weighted average of event (by wAvg)
-    max_event = getAbs(max_event)  # NOTE: might crash if decel_events is empty (highly unlikely)
-    max_event.sort(reverse=True)  # sort max_event for largest decel first
-    w_avg = wAvg(max_event)
+    if values.size == 0:
+        if verbose:
+            print("error, list is empty")
+        return 0
 
-    # calculate compliance relative to max
-    # 5 is a placeholder, this can be changed based on what kind of values wAvg gives out
-    maxWavg = 5
-    compliance = 1.0 - (w_avg / maxWavg)
+    return float(np.dot(values, weightPositions(values.size)) / values.size)
 
-    # cap compliance at 0
-    if compliance < 0:
-        compliance = 0
 
-    return compliance
+def packEvents(events):
+    # flatten a list of events into one array, returns (values, starts, lengths)
+    # empty events are skipped, they can't be scored
+    events = [np.asarray(event, dtype=float) for event in events]
+    events = [event for event in events if event.size > 0]
 
+    if len(events) == 0:
+        return np.empty(0), np.empty(0, dtype=int), np.empty(0, dtype=int)
 
-def wAvg(_list):
-    # weighted average to calculate compliance based on deceleration values
-    weights = [5, 2, 1, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2, 0.1]
-
-    def rel_pos(x, xs):
-        if len(xs) > 0:
-            return xs.index(x) / len(xs)
-        else:
-            if verbose:
-                print("error, list is empty")
-                return 0
-
-    wsum = 0
-    for elem in _list:
-        x = int(round((rel_pos(elem, _list)) * len(weights), 0))
-        wsum += elem * weights[x]
-    wavg = wsum / len(_list)
-
-    return wavg
+    lengths = np.array([event.size for event in events])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.concatenate(events), starts, lengths
+
+
+def calcCompliance(accel_events, decel_events):
+    # calculate compliance using accel and decel events
+
+    # NOTE: accel_events is currently redundant
+    return float(calcCompliances([decel_events])[0])
+
+
+def calcCompliances(tests):
+    # batch version of calcCompliance, tests is a sequence of decel_events (one per compliance test)
+    # returns an array with one compliance per test
+    compliances = np.ones(len(tests))
+
+    # flatten every event of every test, remembering which test it came from
+    events = []
+    owners = []
+    for test_id, decel_events in enumerate(tests):
+        for event in decel_events:
+            if len(event) > 0:
+                events.append(event)
+                owners.append(test_id)
+
+    # no deceleration detected, assume full compliance
+    if len(events) == 0:
+        return compliances
+
+    values, starts, lengths = packEvents(events)
+    abs_values = np.abs(values)
+    owners = np.array(owners)
+
+    # size of every event (by get2Dsize()) in one pass
+    sizes = np.maximum.reduceat(abs_values, starts) * lengths
+
+    # select largest event per test, the last one wins on ties
+    order = np.lexsort((np.arange(sizes.size), sizes, owners))
+    last = np.append(owners[order][1:] != owners[order][:-1], True)
+    chosen = order[last]
+
+    # gather the chosen events into one contiguous array
+    chosen_lengths = lengths[chosen]
+    chosen_starts = np.concatenate(([0], np.cumsum(chosen_lengths)[:-1]))
+    segment = np.repeat(np.arange(chosen.size), chosen_lengths)
+    index = np.repeat(starts[chosen] - chosen_starts, chosen_lengths) + np.arange(chosen_lengths.sum())
+    chosen_values = abs_values[index]
+
+    # sort each event for largest decel first
+    chosen_values = chosen_values[np.lexsort((-chosen_values, segment))]
+
+    # get weighted average of every event (by wAvg)
+    rank = np.arange(chosen_values.size) - np.repeat(chosen_starts, chosen_lengths)
+    position = np.rint(rank / np.repeat(chosen_lengths, chosen_lengths) * len(weights)).astype(int)
+    w = weights[np.minimum(position, len(weights) - 1)]
+    w_avg = np.add.reduceat(chosen_values * w, chosen_starts) / chosen_lengths
+
+    # calculate compliance relative to max, capped at 0
+    compliances[owners[chosen]] = np.maximum(1.0 - (w_avg / maxWavg), 0)
+
+    return compliances
@@ -0,0 +1,462 @@
+# object detection helpers used by ThymPi.getObjects
+
+import collections
+import os
+import time
+
+import cv2
+import numpy as np
+
+# detection model variants, model files are looked up in bin_path
+# input_size trades accuracy for speed, other models can be added with their weights and config files
+# (e.g. quantized exports), anything cv2.dnn_DetectionModel can read works
+MODEL_VARIANTS = {
+    "ssd_mobilenet_v3_large_320": {"weights": "frozen_inference_graph.pb",
+                                   "config": "ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt",
+                                   "input_size": (320, 320)},
+    "ssd_mobilenet_v3_large_256": {"weights": "frozen_inference_graph.pb",
+                                   "config": "ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt",
+                                   "input_size": (256, 256)},
+    "ssd_mobilenet_v3_large_192": {"weights": "frozen_inference_graph.pb",
+                                   "config": "ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt",
+                                   "input_size": (192, 192)},
+    "ssd_mobilenet_v3_small_320": {"weights": "ssd_mobilenet_v3_small_frozen_inference_graph.pb",
+                                   "config": "ssd_mobilenet_v3_small_coco_2020_01_14.pbtxt",
+                                   "input_size": (320, 320)},
+}
+
+# names for setPreferableBackend / setPreferableTarget, only those this OpenCV build knows about
+BACKENDS = {name: getattr(cv2.dnn, constant) for name, constant in (
+    ("default", "DNN_BACKEND_DEFAULT"),
+    ("opencv", "DNN_BACKEND_OPENCV"),
+    ("inference_engine", "DNN_BACKEND_INFERENCE_ENGINE"),
+    ("vkcom", "DNN_BACKEND_VKCOM"),
+    ("cuda", "DNN_BACKEND_CUDA"),
+) if hasattr(cv2.dnn, constant)}
+
+TARGETS = {name: getattr(cv2.dnn, constant) for name, constant in (
+    ("cpu", "DNN_TARGET_CPU"),
+    ("opencl", "DNN_TARGET_OPENCL"),
+    ("opencl_fp16", "DNN_TARGET_OPENCL_FP16"),
+    ("myriad", "DNN_TARGET_MYRIAD"),
+    ("vulkan", "DNN_TARGET_VULKAN"),
+    ("cuda", "DNN_TARGET_CUDA"),
+    ("cuda_fp16", "DNN_TARGET_CUDA_FP16"),
+) if hasattr(cv2.dnn, constant)}
+
+
+def parseVariant(text):
+    # a model variant argument: a MODEL_VARIANTS name, or name=weights,config[,size] for other model files
+    # (e.g. an exported or quantized model) with a square input size (320 by default)
+    # returns (name, weights/config/input_size overrides for loadDetectionModel)
+    if "=" not in text:
+        if text not in MODEL_VARIANTS:
+            raise ValueError("unknown model variant {}, available: {} (or name=weights,config[,size])".format(
+                text, ", ".join(MODEL_VARIANTS)))
+        return text, {}
+
+    name, files = text.split("=", 1)
+    parts = files.split(",")
+    if len(name) == 0 or len(parts) not in (2, 3) or not all(parts):
+        raise ValueError("model variant {} is not name=weights,config[,size]".format(text))
+    try:
+        size = int(parts[2]) if len(parts) == 3 else 320
+    except ValueError:
+        raise ValueError("model variant {} has an input size that isn't a number".format(text))
+    return name, {"weights": parts[0], "config": parts[1], "input_size": (size, size)}
+
+
+def loadDetectionModel(bin_path, variant="ssd_mobilenet_v3_large_320", backend="default", target="cpu", threads=None,
+                       input_size=None, weights=None, config=None, batch=False):
+    # create a cv2.dnn_DetectionModel for a variant in MODEL_VARIANTS
+    # input_size, weights and config override the variant, a variant that isn't in MODEL_VARIANTS needs all three
+    # (see parseVariant), threads sets OpenCV's thread count (None keeps it)
+    # batch=True returns a BatchDetector instead, which can also run several frames in one forward pass
+    spec = MODEL_VARIANTS.get(variant)
+    if spec is None:
+        if weights is None or config is None or input_size is None:
+            raise ValueError("unknown model variant {}, available: {}".format(variant, ", ".join(MODEL_VARIANTS)))
+        spec = {"weights": weights, "config": config, "input_size": input_size}
+    weights = weights or os.path.join(bin_path, spec["weights"])
+    config = config or os.path.join(bin_path, spec["config"])
+    input_size = input_size or spec["input_size"]
+
+    if backend not in BACKENDS:
+        raise ValueError("unknown DNN backend {}, available: {}".format(backend, ", ".join(BACKENDS)))
+    if target not in TARGETS:
+        raise ValueError("unknown DNN target {}, available: {}".format(target, ", ".join(TARGETS)))
+
+    for path in (weights, config):
+        if not os.path.isfile(path):
+            raise FileNotFoundError("model file {} not found".format(path))
+
+    if threads is not None:
+        cv2.setNumThreads(threads)
+
+    if batch:
+        net = cv2.dnn.readNet(weights, config)
+        net.setPreferableBackend(BACKENDS[backend])
+        net.setPreferableTarget(TARGETS[target])
+        return BatchDetector(net, input_size)
+
+    net = cv2.dnn_DetectionModel(weights, config)
+    net.setInputSize(*input_size)
+    net.setInputScale(1.0 / 127.5)
+    net.setInputMean((127.5, 127.5, 127.5))
+    net.setInputSwapRB(True)
+    net.setPreferableBackend(BACKENDS[backend])
+    net.setPreferableTarget(TARGETS[target])
+
+    return net
+
+
+class BatchDetector:
+    # cv2.dnn_DetectionModel replacement for SSD style networks that also detects on a batch of frames
+    # all frames go through the network as one blob (cv2.dnn.blobFromImages), which costs less than
+    # one forward pass per frame
+    # input preprocessing matches loadDetectionModel
+    def __init__(self, net, input_size, scale=1.0 / 127.5, mean=(127.5, 127.5, 127.5), swap_rb=True):
+        self.net = net
+        self.input_size = tuple(input_size)
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+
+    def detect(self, img, confThreshold=0.5, nmsThreshold=0.0):
+        return self.detectBatch([img], confThreshold, nmsThreshold)[0]
+
+    def detectBatch(self, imgs, confThreshold=0.5, nmsThreshold=0.0):
+        # (classIds, confs, bbox) per frame, the same as cv2.dnn_DetectionModel.detect gives for each frame
+        blob = cv2.dnn.blobFromImages(imgs, self.scale, self.input_size, self.mean, self.swap_rb, crop=False)
+        self.net.setInput(blob)
+
+        # DetectionOutput rows: [frame index, class id, confidence, left, top, right, bottom], coordinates in 0..1
+        rows = self.net.forward().reshape(-1, 7)
+
+        results = []
+        for index, img in enumerate(imgs):
+            height, width = img.shape[:2]
+            frame_rows = rows[(rows[:, 0] == index) & (rows[:, 2] >= confThreshold)]
+
+            classIds = frame_rows[:, 1].astype(np.int32)
+            confs = frame_rows[:, 2].astype(np.float32)
+
+            # pixel corners like cv2.dnn_DetectionModel: truncated, clipped to the frame, inclusive width and height
+            corners = (frame_rows[:, 3:7] * [width, height, width, height]).astype(np.int32)
+            left = np.clip(corners[:, 0], 0, width - 1)
+            top = np.clip(corners[:, 1], 0, height - 1)
+            box_width = np.maximum(np.minimum(corners[:, 2], width - 1) - left + 1, 1)
+            box_height = np.maximum(np.minimum(corners[:, 3], height - 1) - top + 1, 1)
+            bbox = np.column_stack((left, top, box_width, box_height))
+
+            # DetectionOutput already suppresses overlapping boxes, cv2.dnn_DetectionModel ignores nmsThreshold
+            # for it and so does this
+            results.append((classIds.reshape(-1, 1), confs.reshape(-1, 1), bbox.reshape(-1, 4)))
+
+        return results
+
+
+def detectBatch(net, imgs, confThreshold=0.5, nmsThreshold=0.0):
+    # batched detection when the net supports it, one detect per frame otherwise
+    if hasattr(net, "detectBatch"):
+        return net.detectBatch(imgs, confThreshold, nmsThreshold)
+    return [net.detect(img, confThreshold=confThreshold, nmsThreshold=nmsThreshold) for img in imgs]
+
+
+def voteDetections(results, conf_threshold):
+    # fuse per-frame detections of a burst into one (classIds, confs, bbox) with a row per class
+    # a class scores the mean over all frames of its best confidence in each frame (0 where it wasn't seen),
+    # so a class has to show up consistently to pass conf_threshold, a single confident frame isn't enough
+    # bbox is the class's box in the frame it scored highest in
+    frames = len(results)
+    empty = np.empty(0, dtype=int), np.empty(0, dtype=np.float32), np.empty((0, 4), dtype=int)
+    if frames == 0:
+        return empty
+
+    classIds = np.concatenate([result[0] for result in results])
+    confs = np.concatenate([result[1] for result in results])
+    bbox = np.concatenate([result[2] for result in results])
+    if len(classIds) == 0:
+        # nothing seen in any frame
+        return empty
+    frame = np.repeat(np.arange(frames), [len(result[0]) for result in results])
+
+    # best detection per (class, frame): sort by class, frame, then confidence and take the last of each group
+    order = np.lexsort((confs, frame, classIds))
+    classIds, confs, bbox, frame = classIds[order], confs[order], bbox[order], frame[order]
+    last = np.flatnonzero(np.append((classIds[1:] != classIds[:-1]) | (frame[1:] != frame[:-1]), True))
+    classIds, confs, bbox = classIds[last], confs[last], bbox[last]
+
+    # per class: summed confidence over frames and the box of its best frame
+    starts = np.flatnonzero(np.insert(classIds[1:] != classIds[:-1], 0, True))
+    fused = np.add.reduceat(confs, starts) / frames if len(starts) > 0 else np.empty(0, dtype=np.float32)
+    best = np.array([start + int(np.argmax(confs[start:end]))
+                     for start, end in zip(starts, np.append(starts[1:], len(confs)))], dtype=int)
+
+    keep = fused >= conf_threshold
+    return classIds[starts][keep], fused[keep].astype(np.float32), bbox[best][keep]
+
+
+def nmsPerClass(classIds, confs, bbox, conf_threshold, nms_threshold):
+    # indices of the detections kept after thresholding and per-class NMS (same as cv2.dnn_DetectionModel)
+    keep = []
+    for class_id in np.unique(classIds):
+        index = np.flatnonzero(classIds == class_id)
+        picked = cv2.dnn.NMSBoxes(bbox[index].tolist(), confs[index].tolist(), conf_threshold, nms_threshold)
+        keep.extend(index[np.array(picked, dtype=int).flatten()].tolist())
+    return np.array(sorted(keep), dtype=int)
+
+
+# one row per detection, see Detections
+DETECTION_DTYPE = np.dtype([("class_id", np.int32), ("name", "U32"), ("confidence", np.float32), ("bbox", np.int32, (4,))])
+
+
+class Detections:
+    # detections of a frame (or burst) as a numpy structured array of DETECTION_DTYPE rows, highest confidence first
+    # bbox is (x, y, width, height) in frame pixels, confidence is 0..1
+    # indexing with an int gives a row, with a slice or mask another Detections
+    __slots__ = ("array",)
+
+    def __init__(self, array=None):
+        self.array = np.empty(0, dtype=DETECTION_DTYPE) if array is None else array
+
+    @classmethod
+    def fromArrays(cls, classIds, confs, bbox, class_names):
+        # from cv2.dnn_DetectionModel.detect style arrays, class ids are 1-based indices into class_names
+        classIds = np.asarray(classIds, dtype=np.int32).flatten()
+        confs = np.asarray(confs, dtype=np.float32).flatten()
+        order = np.argsort(-confs, kind="stable")
+
+        array = np.empty(len(classIds), dtype=DETECTION_DTYPE)
+        array["class_id"] = classIds[order]
+        array["confidence"] = confs[order]
+        array["bbox"] = np.asarray(bbox, dtype=np.int32).reshape(-1, 4)[order]
+
+        # unknown class ids get an empty name
+        lookup = np.append(np.asarray(class_names, dtype=str), "")
+        known = (array["class_id"] >= 1) & (array["class_id"] <= len(lookup) - 1)
+        array["name"] = lookup[np.where(known, array["class_id"] - 1, len(lookup) - 1)]
+
+        return cls(array)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        return iter(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.array[index]
+        return Detections(self.array[index])
+
+    def __repr__(self):
+        return "Detections({})".format(", ".join("{} {:.0f}%".format(name, confidence * 100)
+                                                 for name, confidence in zip(self.names, self.confidences)))
+
+    @property
+    def names(self):
+        return self.array["name"]
+
+    @property
+    def confidences(self):
+        return self.array["confidence"]
+
+    @property
+    def bbox(self):
+        return self.array["bbox"]
+
+    @property
+    def areas(self):
+        return self.array["bbox"][:, 2] * self.array["bbox"][:, 3]
+
+    @property
+    def centres(self):
+        # box centres as an (n, 2) array of (x, y)
+        return self.array["bbox"][:, :2] + self.array["bbox"][:, 2:] / 2
+
+    def best(self):
+        # highest confidence detection, or None
+        return self.array[0] if len(self.array) > 0 else None
+
+    def top(self, k):
+        return Detections(self.array[:k])
+
+    def filter(self, min_confidence=None, names=None, min_area=None):
+        keep = np.ones(len(self.array), dtype=bool)
+        if min_confidence is not None:
+            keep &= self.array["confidence"] >= min_confidence
+        if names is not None:
+            keep &= np.isin(self.array["name"], list(names))
+        if min_area is not None:
+            keep &= self.areas >= min_area
+        return Detections(self.array[keep])
+
+    def perClass(self, reduce="max"):
+        # one detection per class with its best box, confidence reduced over the class ("max", "sum" or "mean")
+        # ordered by the reduced confidence
+        if len(self.array) == 0:
+            return Detections(self.array)
+
+        # stable sort by class keeps each class's rows in confidence order, so the first row is its best
+        order = np.argsort(self.array["class_id"], kind="stable")
+        rows = self.array[order]
+        starts = np.flatnonzero(np.insert(rows["class_id"][1:] != rows["class_id"][:-1], 0, True))
+
+        result = rows[starts].copy()
+        if reduce == "sum":
+            result["confidence"] = np.add.reduceat(rows["confidence"], starts)
+        elif reduce == "mean":
+            result["confidence"] = np.add.reduceat(rows["confidence"], starts) / np.diff(np.append(starts, len(rows)))
+        elif reduce != "max":
+            raise ValueError("unknown reduction {}, use max, sum or mean".format(reduce))
+
+        return Detections(result[np.argsort(-result["confidence"], kind="stable")])
+
+    def counts(self):
+        # detections per class name
+        names, counts = np.unique(self.array["name"], return_counts=True)
+        return dict(zip(names.tolist(), counts.tolist()))
+
+
+def frameSignature(img, size=16):
+    # tiny grayscale thumbnail of a frame, cheap to compute and compare
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+class DetectionCache:
+    # bounded LRU cache of detections keyed by frame signature
+    # a frame whose signature is within threshold of a cached one in every cell (largest absolute grey level
+    # difference) is considered the same scene and gets the cached detections instead of a new inference
+    # thumbnail cells average out sensor noise, and the largest rather than mean difference keeps a small object
+    # that changed from being missed
+    def __init__(self, threshold=12.0, max_entries=16, max_age=30.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age  # seconds a cached result stays valid
+        self.entries = collections.OrderedDict()  # key -> (signature, detections, time added)
+        self.next_key = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, signature):
+        # cached detections for a similar frame, or None
+        now = time.monotonic()
+        for key in [key for key, entry in self.entries.items() if now - entry[2] > self.max_age]:
+            del self.entries[key]
+
+        if len(self.entries) > 0:
+            keys = list(self.entries)
+            signatures = np.stack([self.entries[key][0] for key in keys])
+            differences = np.abs(signatures - signature).max(axis=(1, 2))
+            best = int(np.argmin(differences))
+
+            if differences[best] <= self.threshold:
+                self.entries.move_to_end(keys[best])
+                self.hits += 1
+                return self.entries[keys[best]][1]
+
+        self.misses += 1
+        return None
+
+    def add(self, signature, detections):
+        self.entries[self.next_key] = (signature, detections, time.monotonic())
+        self.next_key += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class ThresholdSweep:
+    # runs inference once per frame at the lowest allowed confidence threshold with NMS disabled,
+    # later queries at any threshold >= min_threshold are answered from the cached raw detections
+    # SSD networks (DetectionOutput, all of MODEL_VARIANTS) suppress overlapping boxes themselves and
+    # cv2.dnn_DetectionModel ignores nmsThreshold for them, so by default only the confidence filter is applied
+    # nms=True applies per-class NMS on top, for networks cv2.dnn_DetectionModel runs NMS on (e.g. YOLO Region)
+    # NMS keeps a box based only on higher scoring boxes, so filtering the cache gives the same result as a new detect
+    # with a DetectionCache, frames that look like a recent one skip inference entirely
+    # detectBurst does the same for a burst of frames, which are inferred as one batch and voted on
+    # inference time and cache use are recorded in metrics (a lib.metrics.Metrics) when given
+    def __init__(self, net, min_threshold=0.1, cache=None, metrics=None, nms=False):
+        self.net = net
+        self.min_threshold = min_threshold
+        self.nms = nms
+        self.cache = cache
+        self.metrics = metrics
+        self.burst = None
+        self.burst_results = None
+        self.frame = None
+        self.classIds = None
+        self.confs = None
+        self.bbox = None
+        self.inferences = 0
+
+    def infer(self, img):
+        self.frame = img
+        self.classIds, self.confs, self.bbox = self.inferMany([img])[0]
+
+    def inferBurst(self, imgs):
+        self.burst = imgs
+        self.burst_results = self.inferMany(imgs)
+
+    def inferMany(self, imgs):
+        # raw detections at min_threshold for every frame, frames the cache knows are not inferred again
+        results = [None] * len(imgs)
+        signatures = [None] * len(imgs)
+        if self.cache is not None:
+            for index, img in enumerate(imgs):
+                signatures[index] = frameSignature(img)
+                results[index] = self.cache.lookup(signatures[index])
+
+        missing = [index for index, result in enumerate(results) if result is None]
+        if self.metrics is not None:
+            self.metrics.counter("detection_cache_hits_total", "frames answered from the detection cache").inc(
+                len(imgs) - len(missing))
+            self.metrics.counter("detect_frames_total", "frames run through the detection model").inc(len(missing))
+
+        if len(missing) > 0:
+            # nmsThreshold=1.0 never suppresses anything (IoU <= 1)
+            start = time.perf_counter()
+            detections = detectBatch(self.net, [imgs[index] for index in missing],
+                                     confThreshold=self.min_threshold, nmsThreshold=1.0)
+            if self.metrics is not None:
+                self.metrics.observe("detect_seconds", time.perf_counter() - start,
+                                     "detection model inference time per call in seconds")
+            self.inferences += 1
+
+            for index, (classIds, confs, bbox) in zip(missing, detections):
+                results[index] = (np.array(classIds, dtype=int).flatten(),
+                                  np.array(confs, dtype=np.float32).flatten(),
+                                  np.array(bbox, dtype=int).reshape(-1, 4))
+                # an empty result isn't cached, the next frame of an empty scene gets a new inference
+                # (e.g. once the object came into view) instead of the same answer for max_age
+                if self.cache is not None and len(results[index][0]) > 0:
+                    self.cache.add(signatures[index], results[index])
+
+        return results
+
+    def detect(self, img, conf_threshold, nms_threshold):
+        # same results as net.detect(img, conf_threshold, nms_threshold), as (classIds, confs, bbox) arrays
+        if img is not self.frame:
+            self.infer(img)
+
+        keep = self.select(self.classIds, self.confs, self.bbox, max(conf_threshold, self.min_threshold), nms_threshold)
+        return self.classIds[keep], self.confs[keep], self.bbox[keep]
+
+    def select(self, classIds, confs, bbox, conf_threshold, nms_threshold):
+        # indices of the cached detections net.detect would have returned
+        if self.nms:
+            return nmsPerClass(classIds, confs, bbox, conf_threshold, nms_threshold)
+        return np.flatnonzero(confs >= conf_threshold)
+
+    def detectBurst(self, imgs, conf_threshold, nms_threshold):
+        # voted detections for a burst of frames (see voteDetections), as (classIds, confs, bbox) arrays
+        if imgs is not self.burst:
+            self.inferBurst(imgs)
+
+        results = []
+        for classIds, confs, bbox in self.burst_results:
+            keep = self.select(classIds, confs, bbox, self.min_threshold, nms_threshold)
+            results.append((classIds[keep], confs[keep], bbox[keep]))
+
+        return voteDetections(results, max(conf_threshold, self.min_threshold))
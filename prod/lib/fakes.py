@@ -0,0 +1,329 @@
+# in-process hardware fakes so ThymPi can run headless (CI, benchmarks, development)
+# FakeWorld simulates a Thymio driving along a line towards obstacles; FakeAsebaNetwork, FakeIMU, FakeNet and
+# FrameSourceCamera all read from the same world, so proximity, collisions, detections and motors stay consistent
+#
+# units: motor speeds are Thymio units (500 ~ 20cm/s), positions are metres, accelerations m/s^2
+
+import os
+import threading
+import time
+
+import numpy as np
+
+MOTOR_UNITS_PER_MS = 2500.0  # 500 units ~ 0.2 m/s
+PROX_RANGE = 0.10  # centre prox sensor range (m)
+PROX_MAX = 4500  # prox.horizontal reading at contact
+
+
+class Obstacle:
+    def __init__(self, class_name, stiffness, damping=10.0, confidence=0.7):
+        self.class_name = class_name
+        self.stiffness = stiffness  # contact spring constant per unit mass (1/s^2), hard objects ~2000, soft ~50
+        self.damping = damping  # contact damping per unit mass (1/s)
+        self.confidence = confidence  # detection confidence FakeNet reports for it
+
+
+# a few coco.names classes with made up stiffnesses
+DEFAULT_OBSTACLES = [
+    Obstacle("cup", 2000.0),
+    Obstacle("teddy bear", 60.0),
+    Obstacle("book", 1200.0),
+    Obstacle("sports ball", 250.0),
+]
+
+
+class SimClock:
+    # ThymPi clock on world time, speedup > 1 runs the world faster than the wall clock
+    def __init__(self, speedup=1.0):
+        self.speedup = speedup
+        self.origin = time.perf_counter()
+
+    def time(self):
+        return (time.perf_counter() - self.origin) * self.speedup
+
+    def sleep(self, seconds):
+        time.sleep(max(seconds, 0) / self.speedup)
+
+    def perfCounter(self, t):
+        # world time t on the time.perf_counter scale
+        return self.origin + t / self.speedup
+
+
+class FakeWorld:
+    def __init__(self, obstacles=None, speedup=1.0, rate=1000, noise=0.05, bias=0.3, tau=0.1,
+                 place_gap=0.05, seed=0):
+        self.clock = SimClock(speedup)
+        self.rate = rate  # physics and IMU sample rate (Hz)
+        self.dt = 1.0 / rate
+        self.noise = noise  # accelerometer noise standard deviation
+        self.bias = bias  # accelerometer x offset, removed by calibration
+        self.tau = tau  # wheel speed time constant (s)
+        self.place_gap = place_gap  # distance in front of the robot new obstacles are placed at (m)
+        self.rng = np.random.default_rng(seed)
+
+        self.obstacles = list(obstacles if obstacles is not None else DEFAULT_OBSTACLES)
+        self.obstacle_index = 0
+        self.obstacle_position = place_gap  # front face of the current obstacle (m)
+
+        self.lock = threading.Lock()
+        self.t = 0.0
+        self.position = 0.0  # robot front (m)
+        self.velocity = 0.0  # m/s
+        self.acceleration = 0.0
+        self.target = (0, 0)  # motor.left.target, motor.right.target
+        self.wheel_speeds = [0.0, 0.0]  # motor units
+
+        # accelerometer samples generated since the last drain
+        self.sample_t = []
+        self.sample_x = []
+
+    @property
+    def obstacle(self):
+        return self.obstacles[self.obstacle_index % len(self.obstacles)]
+
+    def nextObstacle(self):
+        # the current obstacle is taken away and the next one placed in front of the robot
+        self.update()
+        with self.lock:
+            self.obstacle_index += 1
+            self.obstacle_position = self.position + self.place_gap
+
+    def gap(self):
+        return self.obstacle_position - self.position
+
+    def update(self):
+        # integrate the physics up to the current world time
+        with self.lock:
+            now = self.clock.time()
+            steps = int((now - self.t) * self.rate)
+            if steps <= 0:
+                return
+
+            obstacle = self.obstacle
+            accels = np.empty(steps)
+            times = self.t + self.dt * np.arange(1, steps + 1)
+
+            for i in range(steps):
+                for wheel in range(2):
+                    self.wheel_speeds[wheel] += (self.target[wheel] - self.wheel_speeds[wheel]) * self.dt / self.tau
+
+                # wheels drive the robot towards their speed, the obstacle pushes back as a damped spring
+                drive = ((self.wheel_speeds[0] + self.wheel_speeds[1]) / 2 / MOTOR_UNITS_PER_MS - self.velocity)
+                acceleration = drive / self.tau
+                penetration = self.position - self.obstacle_position
+                if penetration > 0:
+                    acceleration -= obstacle.stiffness * penetration + obstacle.damping * self.velocity
+
+                self.velocity += acceleration * self.dt
+                self.position += self.velocity * self.dt
+                accels[i] = acceleration
+
+            self.acceleration = accels[-1]
+            self.t = times[-1]
+
+            readings = accels + self.bias + self.rng.normal(0.0, self.noise, steps)
+            self.sample_t.append(times)
+            self.sample_x.append(readings)
+
+            # keep at most ~10s of undrained samples
+            while len(self.sample_t) > 1 and sum(len(t) for t in self.sample_t) > 10 * self.rate:
+                self.sample_t.pop(0)
+                self.sample_x.pop(0)
+
+    def drainSamples(self):
+        self.update()
+        with self.lock:
+            if len(self.sample_t) == 0:
+                return np.empty(0), np.empty(0)
+            t, x = np.concatenate(self.sample_t), np.concatenate(self.sample_x)
+            self.sample_t = []
+            self.sample_x = []
+            return t, x
+
+    def prox(self):
+        # prox.horizontal, only the centre sensor sees the obstacle
+        self.update()
+        gap = self.gap()
+        values = [0] * 7
+        if gap < PROX_RANGE:
+            values[2] = int(PROX_MAX * min(1.0, 1.0 - gap / PROX_RANGE))
+        return values
+
+    def setTarget(self, left, right):
+        self.update()
+        with self.lock:
+            self.target = (int(left), int(right))
+
+    def render(self, width=640, height=480):
+        # camera view: a noisy floor with the current obstacle as a block that grows as the robot gets closer
+        frame = self.rng.integers(100, 108, (height, width, 3), dtype=np.uint8)
+
+        # look at the world last, so the frame shows the world as it is when read() returns
+        self.update()
+        with self.lock:
+            gap = self.gap()
+            index = self.obstacle_index
+
+        if gap < 0.6:
+            size = int(min(height, 48 / max(gap, 0.1)))
+            shade = 40 + (index % len(self.obstacles)) * 180 // len(self.obstacles)
+            top, left = height // 2 - size // 2, width // 2 - size // 2
+            frame[top:top + size, left:left + size] = shade
+
+        return frame
+
+    def devices(self, frames=None, fps=30):
+        # keyword arguments for ThymPi plus a camera, all backed by this world
+        # the camera renders the world unless frames are given
+        camera = FrameSourceCamera(frames, fps=fps, render=self.render if frames is None else None)
+        return {"aseba_network": FakeAsebaNetwork(self),
+                "sensor": FakeIMU(self),
+                "net": FakeNet(self),
+                "clock": self.clock}, camera
+
+
+class FakeAsebaNetwork:
+    # the ch.epfl.mobots.AsebaNetwork methods ThymPi uses, answered from the world
+    # handlers are called synchronously, like a DBus reply that arrives instantly
+    def __init__(self, world):
+        self.world = world
+        self.calls = 0
+
+    def LoadScripts(self, path, reply_handler=None, error_handler=None):
+        self.calls += 1
+        if reply_handler is not None:
+            reply_handler()
+
+    def GetVariable(self, node, name, reply_handler=None, error_handler=None):
+        self.calls += 1
+        if name == "prox.horizontal":
+            values = self.world.prox()
+        elif name == "motor.left.speed":
+            self.world.update()
+            values = [int(self.world.wheel_speeds[0])]
+        elif name == "motor.right.speed":
+            self.world.update()
+            values = [int(self.world.wheel_speeds[1])]
+        else:
+            values = [0]
+
+        if reply_handler is not None:
+            reply_handler(values)
+        return values
+
+    def SetVariable(self, node, name, values, reply_handler=None, error_handler=None):
+        self.calls += 1
+        if name == "motor.left.target":
+            self.world.setTarget(values[0], self.world.target[1])
+        elif name == "motor.right.target":
+            self.world.setTarget(self.world.target[0], values[0])
+
+        if reply_handler is not None:
+            reply_handler()
+
+    def SendEventName(self, name, args, reply_handler=None, error_handler=None):
+        self.calls += 1
+        if name == "motor.target":
+            self.world.setTarget(args[0], args[1])
+
+        if reply_handler is not None:
+            reply_handler()
+
+
+class FakeIMU:
+    # mpu6050 stand-in that is also an IMU sampler source (see lib.sampler)
+    poll_interval = 0.01
+    buffered = True  # the world keeps samples until they are drained
+
+    def __init__(self, world):
+        self.world = world
+
+    def get_accel_data(self, g=False):
+        self.world.update()
+        x = self.world.acceleration + self.world.bias + self.world.rng.normal(0.0, self.world.noise)
+        if g:
+            x /= 9.80665
+        return {"x": x, "y": 0.0, "z": 9.80665 if not g else 1.0}
+
+    def drain(self):
+        # timestamped with time.perf_counter like lib.sampler.FIFOSource, so recordings line up with the
+        # prox and motor streams
+        t, x = self.world.drainSamples()
+        return self.world.clock.perfCounter(t), x
+
+
+class FakeNet:
+    # cv2.dnn_DetectionModel stand-in, "detects" the current obstacle when it is in camera range
+    def __init__(self, world, class_names=None, camera_range=0.6):
+        self.world = world
+        self.camera_range = camera_range  # m
+        self.class_names = class_names
+        self.inferences = 0
+
+    def detect(self, img, confThreshold=0.5, nmsThreshold=0.2):
+        self.inferences += 1
+        self.world.update()
+        obstacle = self.world.obstacle
+        gap = self.world.gap()
+
+        if self.class_names is None:
+            with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "coco.names")) as f:
+                self.class_names = f.read().rstrip("\n").split("\n")
+
+        if gap > self.camera_range or obstacle.confidence < confThreshold:
+            return np.empty((0, 1), dtype=np.int32), np.empty((0, 1), dtype=np.float32), np.empty((0, 4), dtype=np.int32)
+
+        # closer obstacles fill more of the 640x480 frame
+        size = int(min(480, 48 / max(gap, 0.1)))
+        box = [320 - size // 2, 240 - size // 2, size, size]
+        class_id = self.class_names.index(obstacle.class_name) + 1
+
+        return (np.array([[class_id]], dtype=np.int32),
+                np.array([[obstacle.confidence]], dtype=np.float32),
+                np.array([box], dtype=np.int32))
+
+
+class FrameSourceCamera:
+    # cv2.VideoCapture stand-in that plays back frames (arrays or image files) at fps, looping,
+    # or returns render() when given
+    def __init__(self, frames=None, fps=30, width=640, height=480, render=None):
+        if frames is None:
+            frames = [np.full((height, width, 3), shade, dtype=np.uint8) for shade in (96, 128, 160)]
+        elif isinstance(frames, str):
+            import cv2
+            frames = [cv2.imread(os.path.join(frames, name)) for name in sorted(os.listdir(frames))]
+            frames = [frame for frame in frames if frame is not None]
+
+        self.frames = frames
+        self.render = render
+        self.period = 1.0 / fps
+        self.index = 0
+        self.next_frame = time.perf_counter()
+        self.opened = True
+
+    def read(self):
+        if not self.opened or len(self.frames) == 0:
+            return False, None
+
+        # pace reads like a real camera
+        delay = self.next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame = max(self.next_frame + self.period, time.perf_counter())
+
+        if self.render is not None:
+            return True, self.render()
+
+        # like cv2, every read returns a new array
+        frame = self.frames[self.index % len(self.frames)].copy()
+        self.index += 1
+        return True, frame
+
+    def set(self, prop, value):
+        return True
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        self.opened = False
@@ -0,0 +1,225 @@
+# low overhead hot path metrics: timing histograms, counters and gauges
+# an observation is a bisect and a few additions under a lock, cheap enough to leave on in production
+# exported as Prometheus text exposition format (e.g. for node_exporter's textfile collector) and as a json summary
+
+import bisect
+import json
+import os
+import threading
+import time
+
+# histogram bucket upper bounds in seconds, 100us to ~13s
+DEFAULT_BUCKETS = tuple(0.0001 * 2 ** i for i in range(18))
+
+# histogram bucket upper bounds in m/s^2, for accelerations
+ACCELERATION_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50)
+
+
+class Histogram:
+    def __init__(self, name, help="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        # estimated from the buckets by linear interpolation, None without observations
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            minimum, maximum = self.min, self.max
+        if count == 0:
+            return None
+
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count > 0 and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else minimum
+                upper = self.buckets[index] if index < len(self.buckets) else maximum
+                lower, upper = max(lower, minimum), min(upper, maximum)
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return maximum
+
+    def summary(self):
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count > 0 else None,
+                "min": self.min, "max": self.max,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+    def prometheus(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        with self.lock:
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets + ("+Inf",), self.counts):
+                cumulative += bucket_count
+                le = bucket if isinstance(bucket, str) else "{:g}".format(bucket)
+                lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, le, cumulative))
+            lines.append("{}_sum {!r}".format(self.name, self.sum))
+            lines.append("{}_count {}".format(self.name, self.count))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def summary(self):
+        return self.value
+
+    def prometheus(self):
+        return ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name),
+                "{} {}".format(self.name, self.value)]
+
+
+class Gauge:
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def summary(self):
+        return self.value
+
+    def prometheus(self):
+        if self.value is None:
+            return []
+        return ["# HELP {} {}".format(self.name, self.help), "# TYPE {} gauge".format(self.name),
+                "{} {!r}".format(self.name, float(self.value))]
+
+
+class Timer:
+    # context manager that observes its duration in a histogram
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics:
+    # registry of named metrics, names get the prefix on export
+    # metrics are created on first use, so instrumented code never has to declare them up front
+    def __init__(self, prefix="thympi"):
+        self.prefix = prefix
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get(self, kind, name, help, **options):
+        # options (e.g. histogram buckets) only apply when the metric is created
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(name, kind(self.prefix + "_" + name, help, **options))
+        return metric
+
+    def histogram(self, name, help="", buckets=DEFAULT_BUCKETS):
+        # buckets: upper bounds in the metric's unit, the default suits durations in seconds
+        return self.get(Histogram, name, help, buckets=buckets)
+
+    def counter(self, name, help=""):
+        return self.get(Counter, name, help)
+
+    def gauge(self, name, help=""):
+        return self.get(Gauge, name, help)
+
+    def timer(self, name, help=""):
+        # with metrics.timer("camera_read_seconds"): ...
+        return Timer(self.histogram(name, help))
+
+    def observe(self, name, value, help="", buckets=DEFAULT_BUCKETS):
+        self.histogram(name, help, buckets).observe(value)
+
+    def summary(self):
+        return {name: metric.summary() for name, metric in sorted(self.metrics.items())}
+
+    def prometheus(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+    def write(self, prometheus_path=None, json_path=None):
+        # files are replaced atomically so scrapers never read a partial export
+        for path, text in ((prometheus_path, self.prometheus),
+                           (json_path, lambda: json.dumps(self.summary(), indent=2) + "\n")):
+            if path is not None:
+                temporary = path + ".tmp"
+                with open(temporary, "w") as f:
+                    f.write(text())
+                os.replace(temporary, path)
+
+
+class TimedNetwork:
+    # wraps the Aseba DBus interface and times GetVariable / SetVariable / SendEventName round trips
+    # asynchronous calls are timed until their reply or error handler runs
+    def __init__(self, aseba_network, metrics):
+        self.aseba_network = aseba_network
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.aseba_network, name)
+
+    def call(self, method, histogram, *args, reply_handler=None, error_handler=None):
+        histogram = self.metrics.histogram(histogram, "DBus round trip time in seconds")
+        start = time.perf_counter()
+
+        if reply_handler is None and error_handler is None:
+            try:
+                return getattr(self.aseba_network, method)(*args)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        def reply(*reply):
+            histogram.observe(time.perf_counter() - start)
+            if reply_handler is not None:
+                reply_handler(*reply)
+
+        def error(error):
+            histogram.observe(time.perf_counter() - start)
+            self.metrics.counter("dbus_errors_total", "DBus calls that failed").inc()
+            if error_handler is not None:
+                error_handler(error)
+
+        return getattr(self.aseba_network, method)(*args, reply_handler=reply, error_handler=error)
+
+    def GetVariable(self, node, name, **kwargs):
+        return self.call("GetVariable", "dbus_get_variable_seconds", node, name, **kwargs)
+
+    def SetVariable(self, node, name, values, **kwargs):
+        return self.call("SetVariable", "dbus_set_variable_seconds", node, name, values, **kwargs)
+
+    def SendEventName(self, name, args, **kwargs):
+        return self.call("SendEventName", "dbus_send_event_seconds", name, args, **kwargs)
@@ -0,0 +1,146 @@
+# non-blocking motion primitives
+# every primitive returns a Motion handle right away and runs in its own thread until its deadline, distance or
+# condition is reached, so the caller can keep working (e.g. detecting objects) while the robot moves
+# deadlines are on the ThymPi clock, distance comes from motor.left.speed / motor.right.speed odometry or,
+# without odometry, from the commanded speed
+
+import threading
+
+from lib.scheduler import MonotonicClock
+
+UNITS_PER_CM_S = 25  # motor speed units per cm/s (500 ~ 20cm/s)
+
+
+class Motion:
+    # handle of a running motion primitive
+    def __init__(self, left, right, duration=None, distance_cm=None, until=None, odometry=False):
+        self.left = left
+        self.right = right
+        self.duration = duration  # seconds on the controller clock (None for no time limit)
+        self.target_cm = distance_cm  # distance to travel (None for no distance limit)
+        self.until = until  # callable, the motion ends once it returns True (None to disable)
+        self.odometry = odometry  # measure distance from the wheel speeds instead of the commanded speed
+
+        self.distance_cm = 0.0  # travelled so far
+        # why the motion ended: "deadline", "distance", "condition", "cancelled", "superseded" or "error"
+        self.reason = None
+        self.error = None  # exception that ended the motion (e.g. a failed odometry read)
+        self.superseded = False  # replaced by a newer motion, which keeps the motors running
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        # block until the motion ended, timeout is in wall clock seconds, returns False on timeout
+        return self.finished.wait(timeout)
+
+    def cancel(self):
+        # stop the robot now
+        self.cancelled.set()
+        self.finished.wait()
+
+
+class MotionController:
+    # runs one motion at a time, starting a new one supersedes the current one
+    def __init__(self, set_speed, clock=None, aseba_network=None, node="thymio-II", tick=0.01):
+        self.set_speed = set_speed  # called with (left, right) motor targets
+        self.clock = clock if clock is not None else MonotonicClock()  # provides time() and sleep()
+        self.aseba_network = aseba_network  # for odometry, GetVariable on motor.left.speed / motor.right.speed
+        self.node = node
+        self.tick = tick  # seconds between checks of distance, conditions and cancellation
+        self.current = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def drive(self, left, right, duration=None, distance_cm=None, until=None, odometry=False):
+        # drive at (left, right) until duration passes, distance_cm is travelled or until() returns True,
+        # whichever comes first, then stop
+        motion = Motion(left, right, duration, distance_cm, until, odometry and self.aseba_network is not None)
+        self.start(motion)
+        return motion
+
+    def reverse(self, distance_cm, speed=250, odometry=False):
+        # back up distance_cm, with odometry the time limit is twice the expected duration in case the robot is stuck
+        duration = distance_cm / (speed / UNITS_PER_CM_S)
+        if odometry:
+            return self.drive(-speed, -speed, 2 * duration, distance_cm, odometry=True)
+        return self.drive(-speed, -speed, duration)
+
+    def stop(self):
+        # stop the robot, returns an already finished Motion
+        with self.lock:
+            current = self.current
+        if current is not None:
+            current.cancel()
+
+        motion = Motion(0, 0)
+        self.set_speed(0, 0)
+        motion.reason = "deadline"
+        motion.finished.set()
+        return motion
+
+    def start(self, motion):
+        with self.lock:
+            previous, thread = self.current, self.thread
+            self.current = motion
+            self.thread = threading.Thread(target=self.run, args=(motion,), name="motion", daemon=True)
+
+        if previous is not None and not previous.done():
+            previous.superseded = True
+            previous.cancelled.set()
+            thread.join()
+
+        self.thread.start()
+
+    def wheelSpeed(self):
+        # mean absolute wheel speed in cm/s from the Thymio's motor speed variables
+        left = self.aseba_network.GetVariable(self.node, "motor.left.speed")[0]
+        right = self.aseba_network.GetVariable(self.node, "motor.right.speed")[0]
+        return abs(int(left) + int(right)) / 2 / UNITS_PER_CM_S
+
+    def run(self, motion):
+        # the robot is stopped and motion.finished is set however the motion ends, including on errors
+        try:
+            self.move(motion)
+        except Exception as error:
+            motion.error = error
+            motion.reason = "error"
+        finally:
+            try:
+                if not motion.superseded:
+                    self.set_speed(0, 0)
+            finally:
+                motion.finished.set()
+
+    def move(self, motion):
+        # drive until the motion should end and record why, run() stops the robot afterwards
+        self.set_speed(motion.left, motion.right)
+        start = last = self.clock.time()
+        deadline = None if motion.duration is None else start + motion.duration
+        commanded = abs(motion.left + motion.right) / 2 / UNITS_PER_CM_S
+
+        while True:
+            if motion.cancelled.is_set():
+                motion.reason = "superseded" if motion.superseded else "cancelled"
+                return
+
+            now = self.clock.time()
+            speed = self.wheelSpeed() if motion.odometry else commanded
+            motion.distance_cm += speed * (now - last)
+            last = now
+
+            if motion.target_cm is not None and motion.distance_cm >= motion.target_cm:
+                motion.reason = "distance"
+                return
+            if deadline is not None and now >= deadline:
+                motion.reason = "deadline"
+                return
+            if motion.until is not None and motion.until():
+                motion.reason = "condition"
+                return
+
+            # the last sleep before a deadline ends exactly on it
+            remaining = self.tick if deadline is None else min(self.tick, deadline - now)
+            self.clock.sleep(remaining)
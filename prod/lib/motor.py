@@ -0,0 +1,132 @@
+# non-blocking motor commands
+# targets are handed to a sender thread that drops repeats of the current target, only sends the latest target
+# of a burst and sends asynchronously, recording the round trip latency of every command
+# targets are set as the node's motor.left.target / motor.right.target variables, the motor.target event is
+# global and would drive every robot on the Aseba network
+
+import collections
+import threading
+import time
+
+
+class MotorChannel:
+    def __init__(self, aseba_network, node="thymio-II", timeout=0.5, verbose=False):
+        self.aseba_network = aseba_network
+        self.node = node
+        self.timeout = timeout  # seconds to wait for a reply before sending the next target anyway
+        self.verbose = verbose
+
+        self.condition = threading.Condition()
+        self.pending = None  # latest target not sent yet
+        self.last_sent = None  # last target sent (None if unknown, e.g. after an error)
+        self.in_flight = None  # send time of the command waiting for its reply
+        self.unanswered = 0  # variables of the command in flight that haven't been answered yet
+        self.thread = None
+        self.stopped = False
+
+        self.latencies = collections.deque(maxlen=1000)  # round trip seconds of the latest commands
+        self.sent = 0
+        self.dropped = 0  # identical to the current target
+        self.coalesced = 0  # replaced by a newer target before being sent
+        self.errors = 0
+        self.timeouts = 0
+
+    def start(self):
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="motor-channel", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        # sends whatever is pending before returning, waits at most timeout seconds for it to be answered
+        self.flush(timeout)
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def send(self, left, right):
+        # queue a motor target, returns immediately
+        target = (int(left), int(right))
+
+        with self.condition:
+            current = self.pending if self.pending is not None else self.last_sent
+            if target == current:
+                self.dropped += 1
+                return
+
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = target
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        # wait until every queued target has been sent and answered, returns False on timeout
+        with self.condition:
+            return self.condition.wait_for(lambda: self.pending is None and self.in_flight is None, timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (self.pending is None or self.in_flight is not None):
+                    if self.in_flight is not None:
+                        remaining = self.in_flight + self.timeout - time.perf_counter()
+                        if remaining <= 0:
+                            # no reply in time, don't hold back newer targets
+                            self.timeouts += 1
+                            self.in_flight = None
+                            self.condition.notify_all()
+                            continue
+                        self.condition.wait(remaining)
+                    else:
+                        self.condition.wait()
+
+                if self.stopped:
+                    return
+
+                target, self.pending = self.pending, None
+                self.last_sent = target
+                sent = self.in_flight = time.perf_counter()
+                self.unanswered = len(target)
+
+            try:
+                for name, value in zip(('motor.left.target', 'motor.right.target'), target):
+                    self.aseba_network.SetVariable(self.node, name, [value],
+                                                   reply_handler=lambda *reply, sent=sent: self.reply(sent),
+                                                   error_handler=lambda error, sent=sent: self.error(sent, error))
+            except Exception as error:
+                # e.g. DBus disconnected, keep the channel running for the next target
+                self.error(sent, error)
+
+    def reply(self, sent):
+        # a command is answered once both of its variables are
+        with self.condition:
+            if self.in_flight != sent:
+                return
+            self.unanswered -= 1
+            if self.unanswered > 0:
+                return
+            self.latencies.append(time.perf_counter() - sent)
+            self.sent += 1
+            self.in_flight = None
+            self.condition.notify_all()
+
+    def error(self, sent, error):
+        if self.verbose:
+            print("motor target failed: {}".format(error))
+
+        with self.condition:
+            self.errors += 1
+            self.last_sent = None  # the robot's target is unknown, don't drop the next command
+            if self.in_flight == sent:
+                self.in_flight = None
+            self.condition.notify_all()
+
+    def latencyStats(self):
+        # (count, mean, median, max) round trip seconds of the latest commands
+        with self.condition:
+            latencies = sorted(self.latencies)
+        if len(latencies) == 0:
+            return 0, None, None, None
+        return len(latencies), sum(latencies) / len(latencies), latencies[len(latencies) // 2], latencies[-1]
@@ -0,0 +1,299 @@
+# asyncio runtime for the ThymPi control loop
+# the stages of the synchronous loop in main.run overlap here:
+#   - proximity: waits for obstacles whenever the robot is idle
+#   - frames: keeps the newest camera frame available to the encounter handler
+#   - imu: calibrates the accelerometer in the background whenever the robot stands still (waiting for obstacles,
+#     detecting after backing up, asking whether to retest), so compliance tests don't stop to calibrate
+#   - encounters: backs up, detects (in a detection executor) while reversing and tests compliance
+# blocking ThymPi calls run in executors, the event loop only coordinates
+# shutdown (end of run, cancellation, SIGINT/SIGTERM) always stops the motors
+
+import asyncio
+import concurrent.futures
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.stats import StableEstimate
+
+
+class Orchestrator:
+    def __init__(self, thympi, grabber, retest=None, on_encounter=None, proximity_timeout=0.1):
+        self.thympi = thympi
+        self.grabber = grabber
+        self.retest = retest  # whether to retest objects with a known compliance (None to ask)
+        self.on_encounter = on_encounter  # called with the object name after every encounter (None if nothing found)
+        self.proximity_timeout = proximity_timeout  # seconds per proximity wait, bounds cancellation latency
+
+        # detection is not thread safe, one worker keeps it serialised
+        self.detect_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detect")
+        self.compliance_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compliance")
+        # robot I/O: proximity waits, compliance tests, prompts
+        self.io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="robot")
+
+        # shared state, only touched from the event loop
+        self.idle = None  # asyncio.Event, set while no encounter is running
+        self.still_since = None  # clock time the robot stopped, None while it moves
+        self.encounters_queue = None  # asyncio.Queue of (proximity time, calibration)
+        self.new_frame = None  # asyncio.Condition, notified on every frame
+        self.frame = None  # newest (frame, timestamp)
+        self.estimate = None  # background calibration since the robot stopped, None while it moves
+        self.estimate_mark = None  # sampler position the background calibration has read up to
+        self.robot_calls = set()  # running calls that move the robot, shutdown waits for them
+        self.encounters = []
+
+    async def run(self, max_encounters=None):
+        # handle obstacles until max_encounters (None to run until cancelled), returns the encounters as
+        # (object name, seconds from proximity to done) like main.run
+        loop = asyncio.get_running_loop()
+        self.idle = asyncio.Event()
+        self.encounters_queue = asyncio.Queue(maxsize=1)
+        self.new_frame = asyncio.Condition()
+        self.thympi.compliance_pool = self.compliance_pool
+
+        main = asyncio.current_task()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, main.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass  # not the main thread, or not supported by the platform
+
+        tasks = [asyncio.create_task(self.proximityTask(), name="proximity"),
+                 asyncio.create_task(self.frameTask(), name="frames"),
+                 asyncio.create_task(self.imuTask(), name="imu")]
+        self.setStill()
+        self.idle.set()
+
+        try:
+            while max_encounters is None or len(self.encounters) < max_encounters:
+                start, calibration = await self.encounters_queue.get()
+                await self.handleEncounter(start, calibration)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.shutdown()
+
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(signum)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+        return self.encounters
+
+    async def shutdown(self):
+        # stop the robot whatever state it was left in, then release the executors
+        # a cancelled compliance test keeps running in its thread, wait for it so it can't move the robot afterwards
+        loop = asyncio.get_running_loop()
+        if len(self.robot_calls) > 0:
+            await loop.run_in_executor(None, concurrent.futures.wait, list(self.robot_calls),
+                                       self.thympi.test_duration + 5)
+
+        self.thympi.compliance_pool = None
+        try:
+            self.thympi.motion.stop()
+        finally:
+            self.thympi.setSpeed(0, 0)
+            await loop.run_in_executor(None, self.thympi.motor.flush, 1.0)
+            for pool in (self.detect_pool, self.compliance_pool, self.io_pool):
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    async def robotCall(self, function, *args):
+        # run a blocking call that moves the robot in the robot executor
+        future = self.io_pool.submit(function, *args)
+        self.robot_calls.add(future)
+        future.add_done_callback(self.robot_calls.discard)
+        return await asyncio.wrap_future(future)
+
+    def setStill(self):
+        # the robot stopped, start a new background calibration
+        self.still_since = self.thympi.clock.time()
+        self.estimate = StableEstimate(tolerance=self.thympi.calibration_tolerance)
+        self.estimate_mark = self.thympi.sampler.mark()
+
+    def setMoving(self):
+        self.still_since = None
+        self.estimate = None
+
+    async def proximityTask(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.idle.wait()
+            found = await loop.run_in_executor(self.io_pool, self.thympi.waitForProximity, self.proximity_timeout)
+            if found and self.idle.is_set():
+                self.idle.clear()
+                # a calibration that converged while waiting stays valid after moving
+                await self.encounters_queue.put((time.perf_counter(), self.calibration()))
+
+    async def frameTask(self):
+        loop = asyncio.get_running_loop()
+        last_frame = time.perf_counter()
+        while True:
+            success, frame, timestamp = await loop.run_in_executor(None, self.grabber.wait, last_frame, 0.5)
+            if not success:
+                continue
+            last_frame = timestamp
+            async with self.new_frame:
+                self.frame = (frame, timestamp)
+                self.new_frame.notify_all()
+
+    async def nextFrame(self, after):
+        # first frame captured after time.perf_counter() value after
+        async with self.new_frame:
+            await self.new_frame.wait_for(lambda: self.frame is not None and self.frame[1] > after)
+            return self.frame
+
+    async def nextBurst(self, count, after):
+        # count consecutive frames captured after after, as (frames, last timestamp) like FrameGrabber.burst
+        frames = []
+        while len(frames) < count:
+            frame, after = await self.nextFrame(after)
+            frames.append(frame)
+        return frames, after
+
+    async def imuTask(self):
+        # accumulate a calibration while the robot has been standing still for calibration_settle
+        thympi = self.thympi
+        while True:
+            await asyncio.sleep(max(thympi.sampler.poll_interval, 0.01))
+            estimate = self.estimate
+            if estimate is None or thympi.clock.time() - self.still_since < thympi.calibration_settle:
+                if estimate is not None:
+                    # still settling, skip what was sampled so far
+                    self.estimate_mark = thympi.sampler.mark()
+                continue
+
+            t, xs, self.estimate_mark = thympi.sampler.read(self.estimate_mark)
+            estimate.updateMany(xs)
+
+    def calibration(self):
+        # (average, error range) of the background calibration, None if it hasn't converged
+        estimate = self.estimate
+        if estimate is None or not estimate.converged:
+            return None
+        return estimate.mean, estimate.halfRange
+
+    async def waitCalibration(self):
+        # wait for the background calibration like calibrateSensor would (settle, then up to calibration_duration),
+        # returns None if the robot moved or nothing was sampled
+        thympi = self.thympi
+        end = self.still_since + thympi.calibration_settle + thympi.calibration_duration
+        while self.estimate is not None and not self.estimate.converged and thympi.clock.time() <= end:
+            await asyncio.sleep(0.01)
+
+        estimate = self.estimate
+        if estimate is None or estimate.count == 0:
+            return None
+        return estimate.mean, estimate.halfRange
+
+    async def detect(self, backoff, stopped):
+        # detect on frames taken while backing up at the initial threshold, then on frames after the back-off
+        # with a falling threshold like main.run, stopped is called once the back-off is done
+        # after the back-off a burst of thympi.detection_burst frames is voted on when it is more than 1
+        # returns empty detections after thympi.detection_passes frames (or bursts) after the back-off found nothing
+        thympi = self.thympi
+        loop = asyncio.get_running_loop()
+        after = time.perf_counter()
+        img = None
+        objects = []
+        passes = 0
+
+        while True:
+            reversing = not backoff.done()
+            if img is None or not reversing and thympi.confidence_threshold < thympi.min_confidence_threshold:
+                if img is not None and not reversing:
+                    passes += 1
+                    if passes >= thympi.detection_passes:
+                        return objects
+                if reversing or thympi.detection_burst <= 1:
+                    img, after = await self.nextFrame(after)
+                else:
+                    img, after = await self.nextBurst(thympi.detection_burst, after)
+                thympi.confidence_threshold = 0.5
+
+            if thympi.verbose:
+                print("attempting to detect objects")
+            objects = await loop.run_in_executor(self.detect_pool, thympi.getObjects, img)
+            if len(objects) > 0:
+                return objects
+
+            if reversing:
+                img = None
+                if backoff.done():
+                    # only frames captured after backing up from here on
+                    after = time.perf_counter()
+                    stopped()
+            else:
+                # reduce confidence threshold every time nothing is detected
+                thympi.confidence_threshold = round(thympi.confidence_threshold - 0.025, 3)
+
+    async def handleEncounter(self, start, calibration):
+        # calibration: background calibration from before the robot moved, None if it didn't converge
+        thympi = self.thympi
+        loop = asyncio.get_running_loop()
+
+        if thympi.verbose:
+            print("object in proximity!")
+
+        # go back 10cm (20cm tends to detect most objects) while detecting
+        self.setMoving()
+        backoff = thympi.goBackCM(10, wait=False)
+        try:
+            objects = await self.detect(backoff, self.setStill)
+        finally:
+            await self.robotCall(backoff.wait)
+        if self.still_since is None:
+            self.setStill()
+
+        if len(objects) == 0:
+            print("no object detected, skipping this obstacle")
+            if self.on_encounter is not None:
+                self.on_encounter(None)
+            self.idle.set()
+            return
+
+        for obj in objects:
+            print("{} detected with {:.0f}% confidence".format(obj["name"], obj["confidence"] * 100))
+        maxConfObject = str(objects.best()["name"])
+
+        test = True
+        known_compliance = thympi.compliances.get(maxConfObject)
+        if known_compliance is not None:
+            print("compliance of {} is known to be {}".format(maxConfObject, known_compliance))
+            if self.retest is None:
+                answer = await loop.run_in_executor(
+                    self.io_pool, input, "do you want to retest the compliance of {}?: ".format(maxConfObject))
+                test = answer == "yes" or answer == "y"
+            else:
+                test = self.retest
+        elif thympi.verbose:
+            print("automatically testing compliance of {}".format(maxConfObject))
+
+        if test:
+            if calibration is None:
+                calibration = await self.waitCalibration()
+            if thympi.verbose and calibration is not None:
+                print("using background calibration: average {}, error range +-{}".format(*calibration))
+
+            self.setMoving()
+            await self.robotCall(thympi.testCompliance, maxConfObject, calibration)
+            self.setStill()
+
+        self.encounters.append((maxConfObject, time.perf_counter() - start))
+        thympi.metrics.observe("encounter_seconds", self.encounters[-1][1],
+                               "time from proximity to done per obstacle in seconds")
+        await loop.run_in_executor(self.io_pool, thympi.writeMetrics)
+        if self.on_encounter is not None:
+            self.on_encounter(maxConfObject)
+
+        self.idle.set()
+
+
+def runAsync(thympi, grabber, max_encounters=None, retest=None, on_encounter=None):
+    # asyncio counterpart of main.run
+    orchestrator = Orchestrator(thympi, grabber, retest, on_encounter)
+    try:
+        return asyncio.run(orchestrator.run(max_encounters))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        return orchestrator.encounters
@@ -0,0 +1,236 @@
+# background IMU sampling
+# a thread drains the MPU6050 FIFO with burst reads and writes timestamped samples into a preallocated ring buffer
+# source for mpu6050 library: https://github.com/m-rtijn/mpu6050
+# register map: MPU-6000/MPU-6050 Register Map and Descriptions, revision 4.2
+
+import threading
+import time
+
+import numpy as np
+
+from lib.scheduler import DeadlineSampler
+from lib.stats import RunningStats
+
+# MPU6050 registers not exposed by the mpu6050 library
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+ACCEL_CONFIG = 0x1C
+FIFO_EN = 0x23
+INT_STATUS = 0x3A
+USER_CTRL = 0x6A
+FIFO_COUNTH = 0x72
+FIFO_R_W = 0x74
+
+# register bits
+ACCEL_FIFO_EN = 0x08
+USER_FIFO_EN = 0x40
+USER_FIFO_RESET = 0x04
+FIFO_OFLOW_INT = 0x10
+DLPF_184HZ = 0x01  # gyro output rate of 1kHz, accel output rate is always 1kHz
+
+SAMPLE_BYTES = 6  # accel x, y, z as big endian int16
+BURST_SIZE = 30  # largest multiple of SAMPLE_BYTES within the 32 byte smbus block limit
+
+GRAVITY_MS2 = 9.80665
+ACCEL_SCALES = {0x00: 16384.0, 0x08: 8192.0, 0x10: 4096.0, 0x18: 2048.0}  # LSB/g per ACCEL_CONFIG range
+
+
+class RingBuffer:
+    # fixed size ring of (timestamp, value) samples
+    # every sample is written twice (at i and i + capacity) so the latest capacity samples are always contiguous,
+    # which lets readers get plain numpy views instead of copies
+    # views stay valid until the writer laps them, so read at least once per capacity samples
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.t = np.zeros(2 * capacity)
+        self.x = np.zeros(2 * capacity)
+        self.count = 0  # total samples ever written
+        self.dropped = 0  # samples overwritten before a reader got to them
+        self.lock = threading.Lock()
+
+    def write(self, t, x):
+        n = len(x)
+        if n > self.capacity:
+            self.dropped += n - self.capacity
+            t = t[-self.capacity:]
+            x = x[-self.capacity:]
+            n = self.capacity
+
+        with self.lock:
+            index = (self.count + np.arange(n)) % self.capacity
+            self.t[index] = t
+            self.t[index + self.capacity] = t
+            self.x[index] = x
+            self.x[index + self.capacity] = x
+            self.count += n
+
+    def read(self, mark):
+        # samples written after mark as (t, x, new_mark), t and x are views into the buffer
+        with self.lock:
+            count = self.count
+
+        n = count - mark
+        if n > self.capacity:
+            self.dropped += n - self.capacity
+            n = self.capacity
+
+        end = count % self.capacity + self.capacity
+        return self.t[end - n:end], self.x[end - n:end], count
+
+
+class FIFOSource:
+    # drains accel readings from the MPU6050 FIFO with i2c block reads
+    poll_interval = 0.01  # the 1024 byte FIFO holds ~170ms of accel data at 1kHz
+    buffered = False  # samples are lost unless drained regularly
+
+    def __init__(self, sensor, rate=1000):
+        self.sensor = sensor
+        self.bus = sensor.bus
+        self.address = sensor.address
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.scale = None
+        self.overflows = 0
+
+        self.setup()
+
+    def setup(self):
+        # sample rate = 1kHz / (1 + SMPLRT_DIV)
+        self.bus.write_byte_data(self.address, CONFIG, DLPF_184HZ)
+        self.bus.write_byte_data(self.address, SMPLRT_DIV, max(int(round(1000 / self.rate)) - 1, 0))
+        self.scale = ACCEL_SCALES[self.bus.read_byte_data(self.address, ACCEL_CONFIG) & 0x18]
+        self.reset()
+
+    def reset(self):
+        # reset the FIFO and start buffering accel data
+        self.bus.write_byte_data(self.address, FIFO_EN, 0)
+        self.bus.write_byte_data(self.address, USER_CTRL, USER_FIFO_RESET)
+        self.bus.write_byte_data(self.address, FIFO_EN, ACCEL_FIFO_EN)
+        self.bus.write_byte_data(self.address, USER_CTRL, USER_FIFO_EN)
+
+    def close(self):
+        self.bus.write_byte_data(self.address, FIFO_EN, 0)
+        self.bus.write_byte_data(self.address, USER_CTRL, 0)
+
+    def drain(self):
+        # read every complete sample in the FIFO, returns (t, x) arrays with x in m/s^2
+        if self.bus.read_byte_data(self.address, INT_STATUS) & FIFO_OFLOW_INT:
+            # FIFO contents are misaligned after an overflow, start over
+            self.overflows += 1
+            self.reset()
+            return np.empty(0), np.empty(0)
+
+        high, low = self.bus.read_i2c_block_data(self.address, FIFO_COUNTH, 2)
+        remaining = ((high << 8) | low) // SAMPLE_BYTES * SAMPLE_BYTES
+        now = time.perf_counter()
+
+        data = bytearray()
+        while remaining > 0:
+            size = min(BURST_SIZE, remaining)
+            data += bytes(self.bus.read_i2c_block_data(self.address, FIFO_R_W, size))
+            remaining -= size
+
+        raw = np.frombuffer(bytes(data), dtype=">i2").reshape(-1, 3)
+        x = raw[:, 0] * (GRAVITY_MS2 / self.scale)
+
+        # the FIFO carries no timestamps, the newest sample gets the drain time and older ones are spaced by the period
+        t = now - self.period * np.arange(len(x) - 1, -1, -1)
+
+        return t, x
+
+
+class PollSource:
+    # fallback for sensors without FIFO access, polls get_accel_data on a fixed rate deadline schedule
+    # each drain takes chunk samples, so it blocks for chunk / rate seconds
+    poll_interval = 0
+    buffered = False
+
+    def __init__(self, sensor, rate=1000, chunk=10):
+        self.sensor = sensor
+        self.scheduler = DeadlineSampler(self.read, rate, capacity=chunk)
+        self.lateness = RunningStats()  # seconds from deadline to sample
+        self.intervals = RunningStats()  # seconds between samples
+        self.last = None  # time of the previous sample (ns)
+
+    def read(self):
+        return self.sensor.get_accel_data(g=False)["x"]
+
+    def drain(self):
+        # one chunk of samples as (t, x), x is a view that is reused by the next drain
+        self.scheduler.reset(restart=False)
+        while self.scheduler.count < self.scheduler.capacity:
+            self.scheduler.sample()
+
+        t, x = self.scheduler.samples()
+        self.lateness.updateMany((t - self.scheduler.deadline[:len(t)]) / 1e9)
+        if self.last is not None:
+            self.intervals.update((t[0] - self.last) / 1e9)
+        self.intervals.updateMany(np.diff(t) / 1e9)
+        self.last = t[-1]
+
+        return t / 1e9, x
+
+    def stats(self):
+        # same keys as DeadlineSampler.stats, over every sample since the source was created
+        return {"samples": self.lateness.count, "target_rate": self.scheduler.deadlines.rate,
+                "missed": self.scheduler.deadlines.missed, "dropped": 0,
+                "rate": float(1 / self.intervals.mean) if self.intervals.mean > 0 else None,
+                "jitter": self.intervals.std if self.intervals.count > 0 else None,
+                "lateness_mean": self.lateness.mean if self.lateness.count > 0 else None,
+                "lateness_max": self.lateness.max if self.lateness.count > 0 else None}
+
+
+def makeSource(sensor, rate=1000):
+    # sensors that already provide drain() (e.g. trace replay) are used as is
+    # use the FIFO when the sensor exposes its i2c bus, poll otherwise
+    if hasattr(sensor, "drain"):
+        return sensor
+    if hasattr(sensor, "bus") and hasattr(sensor, "address"):
+        return FIFOSource(sensor, rate)
+    return PollSource(sensor, rate)
+
+
+class IMUSampler:
+    def __init__(self, source, capacity=8192):
+        self.source = source
+        self.buffer = RingBuffer(capacity)
+        self.poll_interval = source.poll_interval
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="imu-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if hasattr(self.source, "close"):
+            self.source.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.update()
+            if self.poll_interval > 0:
+                self.stopped.wait(self.poll_interval)
+
+    def update(self):
+        t, x = self.source.drain()
+        if len(x) > 0:
+            self.buffer.write(t, x)
+
+    def mark(self):
+        # position to read from, only samples taken after this call are returned by read()
+        if self.thread is None:
+            self.update()
+        return self.buffer.count
+
+    def read(self, mark):
+        # samples taken since mark as (t, x, new_mark) views, drains inline when no thread is running
+        if self.thread is None:
+            self.update()
+        return self.buffer.read(mark)
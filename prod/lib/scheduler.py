@@ -0,0 +1,129 @@
+# deadline based sampling at a fixed rate
+# deadlines are absolute (start + k * period on time.perf_counter_ns), so the rate doesn't drift with loop speed
+# or CPU load, a late sample doesn't delay the next one and deadlines that can't be met are skipped and counted
+
+import time
+
+import numpy as np
+
+
+class MonotonicClock:
+    # default clock of ThymPi and its motions, provides time() and sleep() like the time module but its time()
+    # never jumps when the wall clock is set (e.g. an NTP step on a Pi without a real-time clock)
+    def time(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(max(seconds, 0))
+
+
+class Deadlines:
+    def __init__(self, rate, spin_ns=50000):
+        self.rate = rate
+        self.period_ns = int(round(1e9 / rate))
+        self.spin_ns = spin_ns  # busy wait this close to a deadline, time.sleep overshoots by ~50-100us
+        self.next = None  # next deadline (ns)
+        self.missed = 0  # deadlines skipped because they had already passed by a full period
+
+    def start(self, now=None):
+        self.next = time.perf_counter_ns() if now is None else now
+
+    def wait(self):
+        # block until the next deadline and return it (ns)
+        if self.next is None:
+            self.start()
+
+        now = time.perf_counter_ns()
+        late = now - self.next
+        if late >= self.period_ns:
+            # don't catch up with a burst of back to back samples, skip to the current period
+            skipped = late // self.period_ns
+            self.missed += skipped
+            self.next += skipped * self.period_ns
+
+        remaining = self.next - now
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) / 1e9)
+        while time.perf_counter_ns() < self.next:
+            pass
+
+        deadline = self.next
+        self.next += self.period_ns
+        return deadline
+
+
+class DeadlineSampler:
+    # calls read() once per deadline and stores every value with its timestamp in preallocated arrays
+    # t and deadline are perf_counter_ns values, samples past capacity are counted in dropped but not stored
+    def __init__(self, read, rate=1000, capacity=8192, spin_ns=50000):
+        self.read = read
+        self.deadlines = Deadlines(rate, spin_ns)
+        self.t = np.zeros(capacity, dtype=np.int64)
+        self.deadline = np.zeros(capacity, dtype=np.int64)
+        self.x = np.zeros(capacity)
+        self.count = 0
+        self.dropped = 0
+
+    @property
+    def capacity(self):
+        return len(self.x)
+
+    def reset(self, restart=True):
+        # forget stored samples, restart=False keeps the deadline schedule running (e.g. between chunks)
+        self.count = 0
+        self.dropped = 0
+        if restart:
+            self.deadlines.next = None
+            self.deadlines.missed = 0
+
+    def sample(self):
+        # wait for the next deadline, read and store one sample, returns the value
+        deadline = self.deadlines.wait()
+        x = self.read()
+        t = time.perf_counter_ns()
+
+        if self.count < len(self.x):
+            self.t[self.count] = t
+            self.deadline[self.count] = deadline
+            self.x[self.count] = x
+            self.count += 1
+        else:
+            self.dropped += 1
+        return x
+
+    def run(self, seconds):
+        # sample for seconds, returns (t, x) views of the stored samples
+        self.reset()
+        self.deadlines.start()
+        end = self.deadlines.next + int(seconds * 1e9)
+        while self.deadlines.next <= end:
+            self.sample()
+        return self.samples()
+
+    def samples(self):
+        # (t, x) views, t in ns
+        return self.t[:self.count], self.x[:self.count]
+
+    def seconds(self):
+        # sample times in seconds (time.perf_counter scale)
+        return self.t[:self.count] / 1e9
+
+    def stats(self):
+        # achieved rate (Hz), lateness after the deadline and interval jitter (standard deviation of the
+        # time between samples) in seconds, and missed deadlines
+        n = self.count
+        stats = {"samples": n, "target_rate": self.deadlines.rate, "missed": self.deadlines.missed,
+                 "dropped": self.dropped, "rate": None, "jitter": None, "lateness_mean": None, "lateness_max": None}
+        if n == 0:
+            return stats
+
+        lateness = (self.t[:n] - self.deadline[:n]) / 1e9
+        stats["lateness_mean"] = float(lateness.mean())
+        stats["lateness_max"] = float(lateness.max())
+
+        if n > 1:
+            intervals = np.diff(self.t[:n]) / 1e9
+            stats["rate"] = float((n - 1) / intervals.sum()) if intervals.sum() > 0 else None
+            stats["jitter"] = float(intervals.std())
+
+        return stats
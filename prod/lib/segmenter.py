@@ -0,0 +1,143 @@
+# incremental accel/decel event segmentation used during compliance tests
+# samples are read one at a time and memory is bounded by max_events and max_event_size
+
+from lib.stats import RollingWindow
+
+
+class CollisionSegmenter:
+    def __init__(self, noise_floor, max_events=16, max_event_size=512, settle_samples=None, min_decel_events=1):
+        self.noise_floor = noise_floor
+        self.max_events = max_events  # events kept per kind, later ones are dropped (first collision matters most)
+        self.max_event_size = max_event_size  # samples kept per event
+        self.settle_samples = settle_samples  # quiet samples that close an open decel event (None to disable)
+        self.min_decel_events = min_decel_events  # closed decel events needed before the test can stop
+
+        self.accel_events = []
+        self.decel_events = []
+        self.accel_event = []
+        self.decel_event = []
+
+        self.prev = None
+        self.quiet = 0  # samples since the last decel sample
+        self.samples = 0
+
+    @property
+    def done(self):
+        # True once enough collision decel events have closed for calcCompliance
+        return len(self.decel_events) >= self.min_decel_events
+
+    def update(self, x):
+        # feed one calibrated sample, returns self.done
+        noise_floor = self.noise_floor
+        prev = x if self.prev is None else self.prev
+
+        if x > noise_floor:
+            if prev > noise_floor:
+                # accel -> accel
+                self.addSample(self.accel_event, x)
+
+            elif prev <= -1 * noise_floor:
+                # decel -> accel
+                self.closeDecel()
+
+        elif x <= -1 * noise_floor:
+            if prev > noise_floor:
+                # accel -> decel
+                self.closeAccel()
+
+            elif prev <= -1 * noise_floor:
+                # decel -> decel
+                self.addSample(self.decel_event, x)
+
+        # an open decel event followed by enough quiet samples is considered finished
+        if x <= -1 * noise_floor:
+            self.quiet = 0
+        else:
+            self.quiet += 1
+            if self.settle_samples is not None and self.quiet >= self.settle_samples:
+                self.closeDecel()
+
+        self.prev = x
+        self.samples += 1
+
+        return self.done
+
+    def close(self):
+        # flush events still open at the end of a test
+        self.closeAccel()
+        self.closeDecel()
+
+    def addSample(self, event, x):
+        if len(event) < self.max_event_size:
+            event.append(x)
+
+    def closeAccel(self):
+        if len(self.accel_event) > 0:
+            if len(self.accel_events) < self.max_events:
+                self.accel_events.append(self.accel_event)
+            self.accel_event = []
+
+    def closeDecel(self):
+        if len(self.decel_event) > 0:
+            if len(self.decel_events) < self.max_events:
+                self.decel_events.append(self.decel_event)
+            self.decel_event = []
+
+
+class FrameSegmenter:
+    # accel/decel events from the mean of frame_size readings (the legacy framed analysis of tests/compliance_test.py)
+    # framed: one mean per frame_size readings, every frame beyond the noise floor is an event
+    # sliding: the mean of the last frame_size readings after every reading, every excursion beyond the noise floor
+    #   is one event valued at its peak mean, so collisions aren't split or diluted by frame boundaries
+    # the first frame is skipped in both modes (drive-off)
+    def __init__(self, noise_floor, frame_size=50, sliding=False):
+        self.noise_floor = noise_floor
+        self.frame_size = frame_size
+        self.sliding = sliding
+        self.window = RollingWindow(frame_size)
+
+        self.accel_events = []
+        self.decel_events = []
+        self.kind = None  # "accel" or "decel" while a sliding excursion is open
+        self.peak = 0.0  # its peak mean
+
+    def update(self, x):
+        # feed one calibrated sample, returns a newly closed ("accel" | "decel", mean) event or None
+        window = self.window
+        window.update(x)
+        if window.count <= self.frame_size:
+            return None
+
+        if not self.sliding:
+            if window.count % self.frame_size != 0:
+                return None
+            if window.mean > self.noise_floor:
+                self.accel_events.append(window.mean)
+                return "accel", window.mean
+            if window.mean < -1 * self.noise_floor:
+                self.decel_events.append(window.mean)
+                return "decel", window.mean
+            return None
+
+        kind = "accel" if window.mean > self.noise_floor else "decel" if window.mean < -1 * self.noise_floor else None
+        event = None
+        if kind != self.kind:
+            event = self.close()
+            self.kind = kind
+            self.peak = window.mean
+        elif kind == "accel":
+            self.peak = max(self.peak, window.mean)
+        elif kind == "decel":
+            self.peak = min(self.peak, window.mean)
+        return event
+
+    def close(self):
+        # flush a sliding excursion still open at the end of a test, returns it like update
+        kind, self.kind = self.kind, None
+        if kind == "accel":
+            self.accel_events.append(self.peak)
+        elif kind == "decel":
+            self.decel_events.append(self.peak)
+        else:
+            return None
+        return kind, self.peak
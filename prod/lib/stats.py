@@ -0,0 +1,161 @@
+# online statistics with constant memory
+
+import math
+from collections import deque
+
+import numpy as np
+
+
+class RunningStats:
+    # Welford's running mean and variance, plus running min and max
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=math.inf, maximum=-math.inf):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2  # sum of squared differences from the mean
+        self.min = minimum
+        self.max = maximum
+
+    def update(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def updateMany(self, xs):
+        # fold in a chunk of values at once (Chan et al. parallel combination)
+        xs = np.asarray(xs, dtype=float)
+        if xs.size == 0:
+            return
+
+        count = self.count + xs.size
+        mean = float(xs.mean())
+        delta = mean - self.mean
+
+        self.m2 += float(((xs - mean) ** 2).sum()) + delta * delta * self.count * xs.size / count
+        self.mean += delta * xs.size / count
+        self.count = count
+        self.min = min(self.min, float(xs.min()))
+        self.max = max(self.max, float(xs.max()))
+
+    @property
+    def variance(self):
+        # sample variance, 0 until there are two values
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class StableEstimate(RunningStats):
+    # RunningStats that reports when the mean and the half range (max - min) / 2 have settled
+    # converged once the 95% confidence half-width of the mean is within tolerance and the half range
+    # hasn't grown by more than range_tolerance over the last stable_samples values
+    def __init__(self, tolerance=0.02, range_tolerance=0.02, stable_samples=200, min_samples=100):
+        super().__init__()
+        self.tolerance = tolerance
+        self.range_tolerance = range_tolerance
+        self.stable_samples = stable_samples
+        self.min_samples = min_samples
+        self.range_reference = 0.0  # half range when it last grew by more than range_tolerance
+        self.range_changed_at = 0  # count when that happened
+
+    def update(self, x):
+        super().update(x)
+        self.checkRange()
+
+    def updateMany(self, xs):
+        super().updateMany(xs)
+        self.checkRange()
+
+    def checkRange(self):
+        if self.halfRange - self.range_reference > self.range_tolerance:
+            self.range_reference = self.halfRange
+            self.range_changed_at = self.count
+
+    @property
+    def halfRange(self):
+        if self.count == 0:
+            return 0.0
+        return (self.max - self.min) / 2
+
+    @property
+    def confidence(self):
+        # 95% confidence half-width of the mean
+        if self.count < 2:
+            return math.inf
+        return 1.96 * self.std / math.sqrt(self.count)
+
+    @property
+    def converged(self):
+        return (self.count >= self.min_samples
+                and self.confidence <= self.tolerance
+                and self.count - self.range_changed_at >= self.stable_samples)
+
+
+class RollingWindow:
+    # running sum, mean, min and max of the last size values, O(1) per value (amortized for min and max)
+    # values live in a fixed ring, the sum is recomputed exactly once per lap so rounding errors can't accumulate
+    def __init__(self, size):
+        self.size = size
+        self.ring = [0.0] * size
+        self.count = 0  # values seen so far
+        self.sum = 0.0
+        self.minima = deque()  # (index, value) with increasing values, the window's min first
+        self.maxima = deque()  # (index, value) with decreasing values, the window's max first
+
+    def update(self, x):
+        position = self.count % self.size
+        if self.count >= self.size:
+            self.sum -= self.ring[position]
+        self.ring[position] = x
+        self.sum += x
+
+        while len(self.minima) > 0 and self.minima[-1][1] >= x:
+            self.minima.pop()
+        self.minima.append((self.count, x))
+        while len(self.maxima) > 0 and self.maxima[-1][1] <= x:
+            self.maxima.pop()
+        self.maxima.append((self.count, x))
+
+        # drop extremes that slid out of the window
+        oldest = self.count - self.size + 1
+        if self.minima[0][0] < oldest:
+            self.minima.popleft()
+        if self.maxima[0][0] < oldest:
+            self.maxima.popleft()
+
+        self.count += 1
+        if position == self.size - 1:
+            self.sum = math.fsum(self.ring)
+
+    def updateMany(self, xs):
+        for x in np.asarray(xs, dtype=float).tolist():
+            self.update(x)
+
+    @property
+    def length(self):
+        # values currently in the window
+        return min(self.count, self.size)
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.sum / self.length
+
+    @property
+    def min(self):
+        return self.minima[0][1] if self.count > 0 else math.inf
+
+    @property
+    def max(self):
+        return self.maxima[0][1] if self.count > 0 else -math.inf
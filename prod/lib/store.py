@@ -0,0 +1,177 @@
+# persistent compliance store
+# every measurement is kept in sqlite together with a per-class running mean and variance,
+# summaries are loaded lazily on first access and writes happen on a background thread
+# queued writes are committed by close(), which also runs at interpreter exit
+
+import atexit
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+
+from lib.stats import RunningStats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    class_name TEXT NOT NULL,
+    compliance REAL NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_class ON measurements (class_name, timestamp);
+CREATE TABLE IF NOT EXISTS summary (
+    class_name TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    last REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class ComplianceStore:
+    # drop-in for the compliances dict: store[class_name] is the mean measured compliance (None if never tested),
+    # store[class_name] = compliance records a new measurement
+    def __init__(self, path):
+        self.path = path
+        self.stats = None  # class_name -> RunningStats, loaded on first access
+        self.last = {}  # class_name -> last measured compliance
+        self.lock = threading.Lock()
+        self.writes = queue.Queue()
+        self.writer = None
+        self.errors = 0  # batches that failed to commit
+        self.memory = None  # the one connection of an in-memory (":memory:") store
+        self.memory_lock = threading.Lock()
+        atexit.register(self.close)
+
+    @contextlib.contextmanager
+    def connection(self):
+        # a connection for the duration of the block
+        # every sqlite3.connect(":memory:") opens a separate empty database, so an in-memory store keeps one
+        # connection, shared by the writer thread and readers one block at a time
+        if self.path == ":memory:":
+            with self.memory_lock:
+                if self.memory is None:
+                    self.memory = sqlite3.connect(self.path, check_same_thread=False)
+                    self.memory.executescript(SCHEMA)
+                yield self.memory
+            return
+
+        connection = sqlite3.connect(self.path)
+        try:
+            connection.executescript(SCHEMA)
+            yield connection
+        finally:
+            connection.close()
+
+    def load(self):
+        with self.lock:
+            if self.stats is not None:
+                return
+
+            stats = {}
+            with self.connection() as connection:
+                for class_name, count, mean, m2, minimum, maximum, last in connection.execute(
+                        "SELECT class_name, count, mean, m2, min, max, last FROM summary"):
+                    stats[class_name] = RunningStats(count, mean, m2, minimum, maximum)
+                    self.last[class_name] = last
+
+            self.stats = stats
+
+    def __getitem__(self, class_name):
+        self.load()
+        stats = self.stats.get(class_name)
+        return stats.mean if stats is not None else None
+
+    def __setitem__(self, class_name, compliance):
+        self.load()
+        with self.lock:
+            stats = self.stats.setdefault(class_name, RunningStats())
+            stats.update(compliance)
+            self.last[class_name] = compliance
+            summary = (class_name, stats.count, stats.mean, stats.m2, stats.min, stats.max, compliance, time.time())
+
+        self.startWriter()
+        self.writes.put(summary)
+
+    def __contains__(self, class_name):
+        self.load()
+        return class_name in self.stats
+
+    def __iter__(self):
+        self.load()
+        return iter(list(self.stats))
+
+    def get(self, class_name, default=None):
+        value = self[class_name]
+        return default if value is None else value
+
+    def summary(self, class_name):
+        # RunningStats of every measurement of class_name (None if never tested)
+        self.load()
+        return self.stats.get(class_name)
+
+    def history(self, class_name):
+        # every recorded (timestamp, compliance) of class_name, oldest first
+        self.flush()
+        with self.connection() as connection:
+            return connection.execute("SELECT timestamp, compliance FROM measurements WHERE class_name = ? "
+                                      "ORDER BY timestamp", (class_name,)).fetchall()
+
+    def startWriter(self):
+        with self.lock:
+            # a writer that died on a database error is replaced, so later measurements still get written
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self.write, name="compliance-store", daemon=True)
+                self.writer.start()
+
+    def write(self):
+        # writer thread, commits everything queued since the last commit in one transaction
+        # it is a daemon so a missing close() can't hang exit, close() (or atexit) makes the writes durable
+        while True:
+            batch = [self.writes.get()]
+            while not self.writes.empty():
+                batch.append(self.writes.get())
+
+            rows = [row for row in batch if row is not None]
+            try:
+                if len(rows) > 0:
+                    with self.connection() as connection, connection:
+                        connection.executemany(
+                            "INSERT INTO measurements (class_name, compliance, timestamp) VALUES (?, ?, ?)",
+                            [(row[0], row[6], row[7]) for row in rows])
+                        connection.executemany("INSERT OR REPLACE INTO summary VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            except Exception as error:
+                # e.g. the database stayed locked longer than sqlite's timeout, the batch is lost but the writer
+                # keeps going (the next measurement of a class rewrites its summary)
+                self.errors += 1
+                print("could not store {} compliance measurements: {}".format(len(rows), error))
+            finally:
+                # flush() and close() must not wait forever on a batch that failed to commit
+                for _ in batch:
+                    self.writes.task_done()
+
+            if None in batch:
+                return
+
+    def flush(self):
+        # wait until every queued measurement is on disk (or failed to commit)
+        if self.writer is not None:
+            # a dead writer would never acknowledge the measurements queued behind it
+            self.startWriter()
+            self.writes.join()
+
+    def close(self):
+        # commit every queued measurement and stop the writer, the store can still be used afterwards
+        if self.writer is None:
+            return
+        self.startWriter()
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            self.writes.put(None)
+            writer.join()
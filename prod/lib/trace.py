@@ -0,0 +1,299 @@
+# recording and replay of IMU, proximity and motor streams
+# traces are binary columnar files that are memory-mapped on replay, so large recordings load instantly
+#
+# file layout:
+#   MAGIC | column data (each column 64 byte aligned) | json footer | footer length (uint64 le) | MAGIC
+# the footer holds the trace metadata and the name, dtype, shape and offset of every column
+
+import array
+import json
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b"THYMTRC1"
+ALIGN = 64
+PROX_SIZE = 7  # prox.horizontal values
+MOTOR_SIZE = 2  # motor targets (left, right)
+
+# columns per stream: (name, array typecode, numpy dtype, values per row)
+STREAMS = {
+    "accel": (("t", "d", "<f8", 1), ("x", "f", "<f4", 1)),
+    "prox": (("t", "d", "<f8", 1), ("values", "h", "<i2", PROX_SIZE)),
+    "motor": (("t", "d", "<f8", 1), ("values", "h", "<i2", MOTOR_SIZE)),
+}
+
+
+class TraceWriter:
+    # collects samples in compact typed arrays and writes the trace file on close
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.meta = dict(meta or {})
+        self.columns = {}
+        for stream, columns in STREAMS.items():
+            for name, typecode, dtype, size in columns:
+                self.columns[stream + "." + name] = array.array(typecode)
+
+    def addAccel(self, t, x):
+        # t and x can be scalars or arrays
+        self.columns["accel.t"].extend(np.atleast_1d(t).tolist())
+        self.columns["accel.x"].extend(np.atleast_1d(x).tolist())
+
+    def addProx(self, t, values):
+        self.columns["prox.t"].append(t)
+        self.columns["prox.values"].extend(int(v) for v in values)
+
+    def addMotor(self, t, values):
+        self.columns["motor.t"].append(t)
+        self.columns["motor.values"].extend(int(v) for v in values)
+
+    def close(self, **meta):
+        self.meta.update(meta)
+        footer = {"meta": self.meta, "columns": []}
+
+        with open(self.path, "wb") as f:
+            f.write(MAGIC)
+
+            for stream, columns in STREAMS.items():
+                for name, typecode, dtype, size in columns:
+                    key = stream + "." + name
+                    data = np.frombuffer(self.columns[key], dtype=np.dtype(typecode)).astype(dtype)
+
+                    f.write(b"\x00" * (-f.tell() % ALIGN))
+                    shape = [len(data) // size] if size == 1 else [len(data) // size, size]
+                    footer["columns"].append({"name": key, "dtype": dtype, "shape": shape, "offset": f.tell()})
+                    f.write(data.tobytes())
+
+            encoded = json.dumps(footer).encode()
+            f.write(encoded)
+            f.write(struct.pack("<Q", len(encoded)))
+            f.write(MAGIC)
+
+
+class Trace:
+    # read-only view of a trace file, every column is a numpy view into one memory map
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a ThymPi trace".format(path))
+            f.seek(-8 - len(MAGIC), 2)
+            length = struct.unpack("<Q", f.read(8))[0]
+            f.seek(-8 - len(MAGIC) - length, 2)
+            footer = json.loads(f.read(length).decode())
+
+        self.meta = footer["meta"]
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        self.columns = {}
+
+        for column in footer["columns"]:
+            dtype = np.dtype(column["dtype"])
+            nbytes = int(np.prod(column["shape"])) * dtype.itemsize
+            data = self.buffer[column["offset"]:column["offset"] + nbytes].view(dtype)
+            self.columns[column["name"]] = data.reshape(column["shape"])
+
+    def stream(self, name):
+        # columns of one stream as a dict, e.g. trace.stream("accel")["x"]
+        prefix = name + "."
+        return {key[len(prefix):]: data for key, data in self.columns.items() if key.startswith(prefix)}
+
+    @property
+    def start(self):
+        starts = [self.columns[stream + ".t"][0] for stream in STREAMS if len(self.columns[stream + ".t"]) > 0]
+        return min(starts) if len(starts) > 0 else 0.0
+
+    @property
+    def end(self):
+        ends = [self.columns[stream + ".t"][-1] for stream in STREAMS if len(self.columns[stream + ".t"]) > 0]
+        return max(ends) if len(ends) > 0 else 0.0
+
+    @property
+    def test_start(self):
+        # time of the first forward motor target, when testCompliance started driving into the obstacle
+        # (None if the trace has no forward motor target)
+        motor = self.stream("motor")
+        forward = np.flatnonzero((motor["values"] > 0).all(axis=1)) if len(motor["t"]) > 0 else []
+        return float(motor["t"][forward[0]]) if len(forward) > 0 else None
+
+
+class Recorder:
+    # owns the trace currently being written, recording wrappers report to it
+    # calls are no-ops while no trace is open
+    def __init__(self):
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def start(self, path, **meta):
+        with self.lock:
+            self.writer = TraceWriter(path, meta)
+
+    def stop(self, **meta):
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close(**meta)
+
+    def accel(self, t, x):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.addAccel(t, x)
+
+    def prox(self, t, values):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.addProx(t, values)
+
+    def motor(self, t, values):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.addMotor(t, values)
+
+
+class RecordingSource:
+    # wraps an IMU sampler source (see lib.sampler) and records every drained sample
+    def __init__(self, source, recorder):
+        self.source = source
+        self.recorder = recorder
+        self.poll_interval = source.poll_interval
+        self.buffered = source.buffered
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def drain(self):
+        t, x = self.source.drain()
+        if len(x) > 0:
+            self.recorder.accel(t, x)
+        return t, x
+
+    def close(self):
+        if hasattr(self.source, "close"):
+            self.source.close()
+
+
+class RecordingNetwork:
+    # wraps the Aseba DBus interface and records prox.horizontal reads and motor targets
+    # (motor.left.target / motor.right.target variables and motor.target events)
+    def __init__(self, aseba_network, recorder):
+        self.aseba_network = aseba_network
+        self.recorder = recorder
+        self.target = [0, 0]  # last motor target set
+
+    def __getattr__(self, name):
+        return getattr(self.aseba_network, name)
+
+    def GetVariable(self, node, name, **kwargs):
+        values = self.aseba_network.GetVariable(node, name, **kwargs)
+        if name == "prox.horizontal":
+            self.recorder.prox(time.perf_counter(), values)
+        return values
+
+    def SetVariable(self, node, name, values, **kwargs):
+        if name in ("motor.left.target", "motor.right.target"):
+            self.target[name == "motor.right.target"] = int(values[0])
+            self.recorder.motor(time.perf_counter(), list(self.target))
+        return self.aseba_network.SetVariable(node, name, values, **kwargs)
+
+    def SendEventName(self, name, args, **kwargs):
+        if name == "motor.target":
+            self.target = [int(args[0]), int(args[1])]
+            self.recorder.motor(time.perf_counter(), args)
+        return self.aseba_network.SendEventName(name, args, **kwargs)
+
+
+class ReplayClock:
+    # stands in for the time module during replay, runs on trace time
+    # realtime=True follows the wall clock, realtime=False jumps forward on every sleep
+    def __init__(self, start=0.0, realtime=True):
+        self.realtime = realtime
+        self.now = start
+        self.origin = time.perf_counter() - start
+
+    def time(self):
+        if self.realtime:
+            return time.perf_counter() - self.origin
+        return self.now
+
+    def sleep(self, seconds):
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self.now += max(seconds, 0)
+
+    def advance(self, t):
+        # move a fast clock forward to trace time t
+        if not self.realtime and t > self.now:
+            self.now = t
+
+
+class ReplaySensor:
+    # replays the accel stream of a trace, usable as an mpu6050 sensor or directly as an IMU sampler source
+    poll_interval = 0.01
+    buffered = True  # the whole trace is available, no background thread needed
+
+    def __init__(self, trace, clock):
+        accel = trace.stream("accel")
+        self.t = accel["t"]
+        self.x = accel["x"]
+        self.clock = clock
+        self.cursor = 0
+
+    def get_accel_data(self, g=False):
+        # latest sample at the current trace time, a fast clock steps to the next sample
+        if self.cursor < len(self.t):
+            self.clock.advance(self.t[self.cursor])
+        self.cursor = int(np.searchsorted(self.t, self.clock.time(), side="right"))
+        x = float(self.x[self.cursor - 1]) if self.cursor > 0 else 0.0
+        if g:
+            x /= 9.80665
+        return {"x": x, "y": 0.0, "z": 0.0}
+
+    def drain(self):
+        # samples recorded since the last drain up to the current trace time, as views into the trace
+        end = int(np.searchsorted(self.t, self.clock.time(), side="right"))
+        t, x = self.t[self.cursor:end], self.x[self.cursor:end]
+        self.cursor = max(self.cursor, end)
+        return t, x
+
+
+class ReplayNetwork:
+    # replays prox.horizontal from a trace through the AsebaNetwork DBus methods used by ThymPi
+    # variables set and events sent are collected in self.events instead of being sent anywhere
+    def __init__(self, trace, clock):
+        prox = trace.stream("prox")
+        self.t = prox["t"]
+        self.prox = prox["values"]
+        self.clock = clock
+        self.cursor = 0
+        self.events = []
+
+    def LoadScripts(self, path, reply_handler=None, error_handler=None):
+        if reply_handler is not None:
+            reply_handler("replay: {} not loaded".format(path))
+
+    def GetVariable(self, node, name, reply_handler=None, error_handler=None):
+        if name == "prox.horizontal":
+            # a fast clock steps to the next recorded reading
+            if self.cursor < len(self.t):
+                self.clock.advance(self.t[self.cursor])
+            self.cursor = int(np.searchsorted(self.t, self.clock.time(), side="right"))
+            values = self.prox[self.cursor - 1].tolist() if self.cursor > 0 else [0] * PROX_SIZE
+        else:
+            values = [0]
+
+        if reply_handler is not None:
+            reply_handler(values)
+        return values
+
+    def SetVariable(self, node, name, values, reply_handler=None, error_handler=None):
+        self.events.append((self.clock.time(), name, list(values)))
+        if reply_handler is not None:
+            reply_handler()
+
+    def SendEventName(self, name, args, reply_handler=None, error_handler=None):
+        self.events.append((self.clock.time(), name, list(args)))
+        if reply_handler is not None:
+            reply_handler()
@@ -1,97 +1,348 @@
 # main ThymPi file
 
 # general imports
+import argparse
+import json
 import os
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import quoteattr
+
+# numpy imports
+import numpy as np
 
 # opencv imports
 import cv2
 
-# thymio imports
-import dbus
-import dbus.mainloop.glib
-
-# mpu6050 imports
-from mpu6050 import mpu6050
-
 # compliance lib imports
 from lib.compliance import calcCompliance
+from lib.segmenter import CollisionSegmenter, FrameSegmenter
+from lib.sampler import IMUSampler, makeSource
+from lib.trace import Recorder, RecordingNetwork, RecordingSource
+from lib.camera import FrameGrabber
+from lib.detection import (BACKENDS, MODEL_VARIANTS, TARGETS, DetectionCache, Detections, ThresholdSweep,
+                           loadDetectionModel, parseVariant)
+from lib.store import ComplianceStore
+from lib.motor import MotorChannel
+from lib.motion import MotionController
+from lib.scheduler import MonotonicClock
+from lib.stats import StableEstimate
+from lib.metrics import ACCELERATION_BUCKETS, Metrics, TimedNetwork
 
 
 class ThymPi:
-    def __init__(self):
+    def __init__(self, sensor=None, aseba_network=None, clock=None, load_model=True, record_dir=None, verbose=True,
+                 compliances=None, net=None, bin_path=None, detection_burst=1, node="thymio-II", imu_address=0x68,
+                 model_variant="ssd_mobilenet_v3_large_320", dnn_backend="default", dnn_target="cpu", dnn_threads=None,
+                 detection_similarity=12.0, detection_cache_size=16, detection_cache_age=30.0, startup_report=True):
+        # sensor, aseba_network, net and clock can be swapped for stand-ins (e.g. lib.trace replay, lib.fakes)
+        # compliances: dict-like compliance store, the persistent store in bin_path by default
+        # record_dir: directory to write a trace of every compliance test to (None to disable)
+        # node: Aseba node name of the robot, imu_address: i2c address of its MPU6050 (0x68 or 0x69)
+        # detection_burst: frames per detection, more than 1 loads a batch capable model, infers bursts of frames
+        # as one batch and votes on their detections
+        # model_variant, dnn_backend, dnn_target, dnn_threads and detection_* configure the detection model and its
+        # cache, the model loads in the background during construction so they can't be changed afterwards
+        # startup_report: append the startup timings to bin_path/startup_report.jsonl (off for e.g. replays)
+
         # globals
-        self.verbose = True
-        self.compliances = {}
+        self.verbose = verbose
+        self.compliances = compliances
+        self.clock = clock if clock is not None else MonotonicClock()  # provides time() and sleep()
+        self.recorder = Recorder() if record_dir is not None else None
+        self.record_dir = record_dir
+        self.metrics = Metrics()  # hot path timings and counters, see lib/metrics.py
 
         # opencv globals
         self.confidence_threshold = 0.5
-        self.nms_threshold = 0.2
-        self.bin_path = "/home/pi/Documents/ThymPi/prod/bin"
+        self.min_confidence_threshold = 0.1  # lowest threshold detection may fall back to (default=0.1)
+        self.nms_threshold = 0.2  # only used by networks cv2.dnn_DetectionModel runs NMS on (not SSD)
+        self.detection_passes = 3  # frames (or bursts) tried down to min_confidence_threshold before giving up
+        self.bin_path = bin_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+        self.compliance_path = os.path.join(self.bin_path, "compliances.db")
         self.class_names = []
-        self.net = None
+        self.net = net
+        self.sweep = None
+        self.model_variant = model_variant  # a MODEL_VARIANTS name or name=weights,config[,size] (see parseVariant)
+        self.dnn_backend = dnn_backend  # see BACKENDS in lib/detection.py
+        self.dnn_target = dnn_target  # see TARGETS in lib/detection.py
+        self.dnn_threads = dnn_threads  # OpenCV thread count (None for OpenCV's default)
+        self.detection_similarity = detection_similarity  # grey level difference to reuse cached detections below
+        self.detection_cache_size = detection_cache_size  # cached detection results (0 to always run inference)
+        self.detection_cache_age = detection_cache_age  # seconds a cached detection result stays valid
+        self.detection_burst = detection_burst
+        self.model = None  # future of the background model setup
 
         # thymio globals
-        self.aseba_network = None
+        self.node = node
+        self.aseba_network = aseba_network
+        self.bus = None
+        self.motor = None
+        self.motion = None
+        self.motion_odometry = False  # measure back-off distances with wheel speed odometry instead of timing
         self.currentLeftSpeed = None
         self.currentRightSpeed = None
+        self.prox_threshold = 0  # centre prox.horizontal value that counts as an obstacle (default=0)
+        self.prox_poll_interval = 0.05  # polling interval when prox.trigger events are unavailable (seconds)
+        self.proximity = threading.Event()  # set by the prox.trigger event
+        self.proximity_value = None
+        self.proximity_events = False  # True once subscribed to prox.trigger
+        self.node_id = None  # Aseba id of the node, tells its prox.trigger events from other robots'
 
         # mpu6050 globals
-        self.sensor = None
-        self.calibration_duration = 1  # mpu6050 calibration duration (seconds, default=1)
-        self.test_duration = 2  # compliance test duration (seconds, default=2)
+        self.sensor = sensor
+        self.imu_address = imu_address
+        self.sampler = None
+        self.imu_rate = 1000  # mpu6050 FIFO sample rate (Hz, default=1000)
+        self.calibration_duration = 1  # maximum mpu6050 calibration duration (seconds, default=1)
+        self.calibration_settle = 0.2  # wait after stopping before calibrating (seconds, default=0.2)
+        self.calibration_tolerance = 0.02  # 95% confidence half-width of the calibration mean to stop at (m/s^2)
+        self.test_duration = 2  # maximum compliance test duration (seconds, default=2)
+        self.settle_samples = 25  # quiet readings that end a collision decel event (default=25)
         self.test_speed = 500  # compliance test speed (default=500)
-        self.frame_size = 50  # LEGACY: accelerometer reading frame size (default=50)
-
-        # call setup methods
-        self.setupModel()
-        self.setupThymio()
-        self.setupIMU()
+        self.frame_size = 50  # readings averaged by the framed collision analysis (default=50)
+        self.frame_sliding = True  # average the last frame_size readings after every reading, not once per frame
+        self.compliance_pool = None  # executor to run calcCompliance in (None to run it in the calling thread)
+
+        # startup globals
+        self.startup_report_path = os.path.join(self.bin_path, "startup_report.jsonl") if startup_report else None
+
+        # metrics globals
+        self.metrics_path = os.path.join(self.bin_path, "metrics.prom")  # Prometheus text export (None to disable)
+        self.metrics_summary_path = os.path.join(self.bin_path, "metrics.json")  # json export (None to disable)
+        self.startup_start = time.perf_counter()
+        self.startup_stages = {}  # stage -> (start, duration) in seconds since startup_start
+
+        # measured compliances survive restarts, the store loads on first use
+        if self.compliances is None:
+            self.compliances = ComplianceStore(self.compliance_path)
+
+        # call setup methods concurrently, the model keeps loading in the background
+        # so proximity monitoring can start before it is ready (getObjects waits for it)
+        pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="setup")
+        if load_model:
+            self.model = pool.submit(self.loadModel)
+        thymio = pool.submit(self.timeStage, "thymio", self.setupThymio)
+        imu = pool.submit(self.timeStage, "imu", self.setupIMU)
+        thymio.result()
+        imu.result()
+        pool.shutdown(wait=False)
+
+        self.startup_stages["control_ready"] = (0.0, time.perf_counter() - self.startup_start)
+
+        if self.model is not None:
+            self.model.add_done_callback(lambda future: self.writeStartupReport())
+        else:
+            self.writeStartupReport()
 
         if self.verbose:
             print("setup complete! \n")
 
+    def timeStage(self, stage, setup):
+        start = time.perf_counter()
+        setup()
+        self.startup_stages[stage] = (start - self.startup_start, time.perf_counter() - start)
+
+    def loadModel(self):
+        self.timeStage("model.load", self.setupModel)
+        self.timeStage("model.warmup", self.warmupModel)
+        self.startup_stages["ready"] = (0.0, time.perf_counter() - self.startup_start)
+
+        if self.verbose:
+            print("detection model ready")
+
+    def waitForModel(self):
+        # block until the background model setup is done, raises if it failed
+        if self.model is not None:
+            self.model.result()
+
+    def writeStartupReport(self):
+        # append this startup's per-stage timings to startup_report_path (one json object per line)
+        report = {"timestamp": time.time(),
+                  "stages": {stage: {"start": start, "duration": duration}
+                             for stage, (start, duration) in self.startup_stages.items()}}
+
+        # seconds since power on, if the platform exposes it
+        try:
+            with open("/proc/uptime") as f:
+                report["uptime"] = float(f.read().split()[0])
+        except OSError:
+            report["uptime"] = None
+
+        if self.model is not None and self.model.exception() is not None:
+            report["error"] = str(self.model.exception())
+
+        if self.verbose:
+            print("startup timings:")
+            for stage, (start, duration) in sorted(self.startup_stages.items(), key=lambda item: item[1]):
+                print("    {}: started {:.3f}s, took {:.3f}s".format(stage, start, duration))
+
+        if self.startup_report_path is None:
+            return
+        try:
+            with open(self.startup_report_path, "a") as f:
+                f.write(json.dumps(report) + "\n")
+        except OSError as error:
+            if self.verbose:
+                print("could not write startup report: {}".format(error))
+
     def setupModel(self):
         if self.verbose:
             print("setting up openCV detection model")
         classFile = os.path.join(self.bin_path, "coco.names")
-        configFile = os.path.join(self.bin_path, "ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt")
-        weightsFile = os.path.join(self.bin_path, "frozen_inference_graph.pb")
 
         # read class file into class_names list
         with open(classFile, "rt") as f:
             self.class_names = f.read().rstrip("\n").split("\n")
 
-        # fill compliances dict
-        for class_name in self.class_names:
-            self.compliances[class_name] = None
+        if self.net is None:
+            variant, files = parseVariant(self.model_variant)
+            self.net = loadDetectionModel(self.bin_path, variant, self.dnn_backend, self.dnn_target,
+                                          self.dnn_threads, batch=self.detection_burst > 1, **files)
 
-        self.net = cv2.dnn_DetectionModel(weightsFile, configFile)
-        self.net.setInputSize(320, 320)
-        self.net.setInputScale(1.0 / 127.5)
-        self.net.setInputMean((127.5, 127.5, 127.5))
-        self.net.setInputSwapRB(True)
+        # one inference per frame, lower thresholds are answered from its cached results
+        # and frames that look like a recent one reuse its detections
+        cache = None
+        if self.detection_cache_size > 0:
+            cache = DetectionCache(self.detection_similarity, self.detection_cache_size, self.detection_cache_age)
+        self.sweep = ThresholdSweep(self.net, self.min_confidence_threshold, cache, self.metrics)
+
+    def warmupModel(self):
+        # the first inference allocates everything and is much slower than the rest, get it out of the way
+        self.net.detect(np.zeros((480, 640, 3), dtype=np.uint8), confThreshold=self.confidence_threshold)
 
     def setupThymio(self):
         if self.verbose:
             print("setting up Thymio-II AsebaMedulla interface")
 
-        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-        bus = dbus.SessionBus()
-        asebaNetworkObject = bus.get_object('ch.epfl.mobots.Aseba', '/')
-        self.aseba_network = dbus.Interface(asebaNetworkObject, dbus_interface='ch.epfl.mobots.AsebaNetwork')
-        self.aseba_network.LoadScripts(os.path.join(self.bin_path, "thympi.aesl"),
+        if self.aseba_network is None:
+            import dbus
+            import dbus.mainloop.glib
+
+            dbus.mainloop.glib.threads_init()
+            dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+            bus = self.bus = dbus.SessionBus()
+            asebaNetworkObject = bus.get_object('ch.epfl.mobots.Aseba', '/')
+            self.aseba_network = dbus.Interface(asebaNetworkObject, dbus_interface='ch.epfl.mobots.AsebaNetwork')
+
+        if self.recorder is not None:
+            self.aseba_network = RecordingNetwork(self.aseba_network, self.recorder)
+        self.aseba_network = TimedNetwork(self.aseba_network, self.metrics)
+
+        self.aseba_network.LoadScripts(self.nodeScript(),
                                        reply_handler=self.dbusReply,
                                        error_handler=self.dbusError)
 
+        # motor commands are sent from their own thread, setSpeed never waits on DBus
+        self.motor = MotorChannel(self.aseba_network, self.node, verbose=self.verbose)
+        self.motor.start()
+
+        # motion primitives (e.g. goBackCM) run in the background and return a handle
+        self.motion = MotionController(self.setSpeed, self.clock, self.aseba_network, self.node)
+
+        if self.bus is not None:
+            self.setupProximityTrigger()
+
+    def nodeScript(self):
+        # thympi.aesl programs the node named thymio-II, LoadScripts leaves every other node alone,
+        # so other nodes (e.g. the robots of a fleet) get a copy of the script with their own name
+        path = os.path.join(self.bin_path, "thympi.aesl")
+        if self.node == "thymio-II":
+            return path
+
+        with open(path) as f:
+            script = f.read()
+        nodePath = os.path.join(tempfile.gettempdir(), "thympi-{}.aesl".format("".join(
+            c if c.isalnum() or c in "-_" else "_" for c in self.node)))
+        with open(nodePath, "w") as f:
+            f.write(script.replace('name="thymio-II"', 'name={}'.format(quoteattr(self.node))))
+        return nodePath
+
+    def setupProximityTrigger(self):
+        # thympi.aesl emits prox.trigger when the centre sensor crosses prox_threshold,
+        # listen for it as a DBus signal instead of polling GetVariable
+        # events are broadcast to the whole Aseba network, the payload carries the emitting node's id
+        import dbus
+        from gi.repository import GLib
+
+        self.node_id = int(self.aseba_network.GetVariable(self.node, '_id')[0])
+
+        filterPath = self.aseba_network.CreateEventFilter()
+        eventFilter = dbus.Interface(self.bus.get_object('ch.epfl.mobots.Aseba', filterPath),
+                                     dbus_interface='ch.epfl.mobots.EventFilter')
+        eventFilter.ListenEventName('prox.trigger')
+        eventFilter.connect_to_signal('Event', self.proximityEvent)
+
+        # only this node's threshold, an event would set every node's
+        for name, value in (('prox_trigger_threshold', self.prox_threshold), ('prox_triggered', 0)):
+            self.aseba_network.SetVariable(self.node, name, [value],
+                                           reply_handler=self.dbusReply,
+                                           error_handler=self.dbusError)
+
+        # signals (and async replies) are dispatched by the GLib main loop
+        threading.Thread(target=GLib.MainLoop().run, name="dbus-loop", daemon=True).start()
+        self.proximity_events = True
+
+    def proximityEvent(self, eventId, eventName, eventPayload):
+        if int(eventPayload[1]) != self.node_id:
+            return  # another robot's obstacle
+        self.proximity_value = int(eventPayload[0])
+        self.proximity.set()
+
+    def waitForProximity(self, timeout=None):
+        # wait until the centre prox sensor sees something, returns False on timeout
+        # (detection distance ~ 10cm with the default threshold)
+        if self.proximity_events:
+            end = None if timeout is None else time.monotonic() + timeout
+            while True:
+                if not self.proximity.wait(None if end is None else max(end - time.monotonic(), 0)):
+                    return False
+                self.proximity.clear()
+
+                # the edge may have been latched by something that is gone by now (e.g. the drive into an obstacle
+                # during a compliance test), only report it if the sensor still sees something
+                value = self.proximityLevel()
+                if value > self.prox_threshold:
+                    self.proximity_value = value
+                    return True
+
+        # no event subscription (e.g. replay), poll at prox_poll_interval
+        end = None if timeout is None else self.clock.time() + timeout
+        while end is None or self.clock.time() <= end:
+            value = self.proximityLevel()
+            if value > self.prox_threshold:
+                self.proximity_value = value
+                return True
+            self.clock.sleep(self.prox_poll_interval)
+        return False
+
+    def proximityLevel(self):
+        # current centre prox sensor value
+        return int(self.aseba_network.GetVariable(self.node, 'prox.horizontal')[2])
+
     def setupIMU(self):
         if self.verbose:
             print("setting up MPU6050")
-        self.sensor = mpu6050(0x68)
+        if self.sensor is None:
+            from mpu6050 import mpu6050
+            self.sensor = mpu6050(self.imu_address)
 
-    def dbusReply(self, reply):
-        if self.verbose:
-            print(reply)
+        source = makeSource(self.sensor, self.imu_rate)
+        if self.recorder is not None:
+            source = RecordingSource(source, self.recorder)
+
+        # sample in the background, readers get views of the sampler's ring buffer
+        # recorded traces are drained inline instead
+        self.sampler = IMUSampler(source)
+        if not source.buffered:
+            self.sampler.start()
+
+    def dbusReply(self, *reply):
+        # void methods (LoadScripts, SetVariable, SendEventName) reply without arguments
+        if self.verbose and len(reply) > 0:
+            print(*reply)
 
     def dbusError(self, error):
         if self.verbose:
@@ -100,172 +351,330 @@ class ThymPi:
     def calibrateSensor(self):
         # stop and wait
         self.setSpeed(0, 0)
-        time.sleep(0.2)
+        self.clock.sleep(self.calibration_settle)
 
-        # start calibration
-        xs = []
-        end = time.time() + self.calibration_duration
+        # start calibration, stops early once the mean and error range are stable
+        estimate = StableEstimate(tolerance=self.calibration_tolerance)
+        mark = self.sampler.mark()
+        end = self.clock.time() + self.calibration_duration
 
-        while time.time() <= end:
-            xs.append(self.sensor.get_accel_data(g=False)["x"])
+        start = self.clock.time()
+        while self.clock.time() <= end and not estimate.converged:
+            self.clock.sleep(self.sampler.poll_interval)
+            t, xs, mark = self.sampler.read(mark)
+            estimate.updateMany(xs)
+        self.recordSampleRate("calibration", estimate.count, self.clock.time() - start)
 
-        avg = sum(xs) / len(xs)
-        error = (max(xs) - min(xs)) / 2
+        avg = estimate.mean
+        error = estimate.halfRange
 
         if self.verbose:
             print("""calibration results: 
         average value: {}
         error range +-: {}
-        data points: {}""".format(avg, error, len(xs)))
+        data points: {}
+        mean confidence +-: {}
+        converged: {}""".format(avg, error, estimate.count, estimate.confidence, estimate.converged))
 
         return avg, error
 
-    def testCompliance(self, class_name):
+    def testCompliance(self, class_name, calibration=None):
+        # calibration: (average, error range) from a calibration taken while the robot stood still,
+        # None to stop and calibrate first
+        if self.recorder is not None:
+            # drain samples taken before the test (e.g. while driving up to the obstacle) so the trace doesn't start
+            # with them, background samplers drain continuously
+            self.sampler.mark()
+            self.recorder.start(os.path.join(self.record_dir, "{}-{}.trace".format(class_name, int(time.time() * 1000))),
+                                class_name=class_name)
+
         # perform calibration at start (stop, wait and calibrate)
-        c_mean, c_error = self.calibrateSensor()
+        if calibration is None:
+            calibration = self.calibrateSensor()
+        c_mean, c_error = calibration
         noise_floor = 2 * (c_error - c_mean)
 
         # start test
         self.setSpeed(self.test_speed, self.test_speed)
 
-        xs = []
-        accel_events = []
-        decel_events = []
-
-        accel_event = []
-        decel_event = []
-
-        i = 0
-        prev = None
-
-        end = time.time() + self.test_duration
-
-        while time.time() <= end:
-            x = self.sensor.get_accel_data(g=False)["x"] - c_mean
-            xs.append(x)
-
-            # NOTE: might work without this
-            if i == 0:
-                prev = x
-
-            # only perform calculations every time an accel_event or decel_event finishes
-            if x > noise_floor:
-                if prev > noise_floor:
-                    # accel -> accel
-                    accel_event.append(x)
-
-                elif prev <= -1 * noise_floor:
-                    # decel -> accel
-                    if len(decel_event) > 0:
-                        decel_events.append(decel_event)
-                        decel_event = []
-
-            elif x <= -1 * noise_floor:
-                if prev > noise_floor:
-                    # accel -> decel
-                    if len(accel_event) > 0:
-                        accel_events.append(accel_event)
-                        accel_event = []
-
-                elif prev <= -1 * noise_floor:
-                    # decel -> decel
-                    decel_event.append(x)
-
-            prev = x
-            i += 1
-
-        # go back 10 cm after test
-        self.goBackCM(10)
-
-        compliance = calcCompliance(accel_events, decel_events)
+        segmenter = CollisionSegmenter(noise_floor, settle_samples=self.settle_samples)
+        # framed analysis of the same readings, its peak decel is the collision's strength
+        frames = FrameSegmenter(c_error - c_mean, self.frame_size, self.frame_sliding)
+
+        mark = self.sampler.mark()
+        start = self.clock.time()
+        end = start + self.test_duration
+        samples = 0
+
+        while self.clock.time() <= end and not segmenter.done:
+            self.clock.sleep(self.sampler.poll_interval)
+            t, xs, mark = self.sampler.read(mark)
+            samples += len(xs)
+
+            for x in (xs - c_mean).tolist():
+                frames.update(x)
+                # stop as soon as the first collision decel event has closed
+                if segmenter.update(x):
+                    break
+
+        segmenter.close()
+        frames.close()
+        if len(frames.decel_events) > 0:
+            self.metrics.observe("collision_decel_meters_per_second_squared", -frames.decel_events[0],
+                                 "peak framed deceleration of the first collision", ACCELERATION_BUCKETS)
+        self.recordSampleRate("test", samples, self.clock.time() - start)
+
+        # go back 10 cm after test, computing the compliance meanwhile
+        backoff = self.goBackCM(10, wait=False)
+
+        with self.metrics.timer("calc_compliance_seconds", "calcCompliance time in seconds"):
+            if self.compliance_pool is not None:
+                compliance = self.compliance_pool.submit(calcCompliance, segmenter.accel_events,
+                                                         segmenter.decel_events).result()
+            else:
+                compliance = calcCompliance(segmenter.accel_events, segmenter.decel_events)
+        backoff.wait()
+        # driving into the obstacle fired prox.trigger, it must not start another encounter
+        self.proximity.clear()
+        self.metrics.counter("compliance_tests_total", "compliance tests run").inc()
         self.compliances[class_name] = compliance
 
+        if self.recorder is not None:
+            self.recorder.stop(c_mean=c_mean, c_error=c_error, compliance=compliance,
+                               frame_decel_events=frames.decel_events)
+
         if self.verbose:
             print("known compliances: ")
             for comp in self.compliances:
-                if self.compliances[comp] != None:
+                if self.compliances.get(comp) is not None:
                     print("class: {} | compliance: {}".format(comp, self.compliances[comp]))
 
-    def getObjects(self, img):
-        classIds, confs, bbox = self.net.detect(img,
-                                                confThreshold=self.confidence_threshold,
-                                                nmsThreshold=self.nms_threshold
-                                                )
-
-        objects = {}
-
-        if len(classIds) > 0:
-            obj_names = []
-            obj_confidences = []
+    def recordSampleRate(self, stage, samples, seconds):
+        # achieved IMU sample rate of a calibration or test run
+        self.metrics.counter("imu_samples_total", "IMU samples read").inc(samples)
+        if seconds > 0:
+            self.metrics.gauge(stage + "_imu_samples_per_second",
+                               "IMU samples per second during the last {}".format(stage)).set(samples / seconds)
+
+        # deadline scheduled sources (polling) also report timing jitter
+        stats = getattr(self.sampler.source, "stats", None)
+        if stats is not None:
+            stats = stats()
+            for name, key, help in (("imu_jitter_seconds", "jitter", "standard deviation of IMU sample intervals"),
+                                    ("imu_lateness_max_seconds", "lateness_max", "latest IMU sample after its deadline"),
+                                    ("imu_missed_deadlines", "missed", "IMU sample deadlines skipped")):
+                if stats[key] is not None:
+                    self.metrics.gauge(name, help).set(stats[key])
+
+    def writeMetrics(self):
+        # export metrics to metrics_path and metrics_summary_path
+        try:
+            self.metrics.write(self.metrics_path, self.metrics_summary_path)
+        except OSError as error:
+            if self.verbose:
+                print("could not write metrics: {}".format(error))
 
-            for classId in classIds:
-                obj_names.append(self.class_names[classId - 1])
+    def getObjects(self, img):
+        # detections as a lib.detection.Detections array, highest confidence first
+        # img is a frame or a list of frames (a burst), whose detections are voted on
+        self.waitForModel()
 
-            for conf in confs:
-                obj_confidences.append(round(conf * 100, 0))
+        if isinstance(img, list):
+            classIds, confs, bbox = self.sweep.detectBurst(img, self.confidence_threshold, self.nms_threshold)
+        else:
+            classIds, confs, bbox = self.sweep.detect(img, self.confidence_threshold, self.nms_threshold)
 
-            objects = dict(zip(obj_names, obj_confidences))
+        objects = Detections.fromArrays(classIds, confs, bbox, self.class_names)
 
-            if self.verbose:
-                print(objects)
+        if self.verbose and len(objects) > 0:
+            print(objects)
 
         return objects
 
     def setSpeed(self, left, right):
-        self.aseba_network.SendEventName('motor.target', [left, right])
+        self.currentLeftSpeed = left
+        self.currentRightSpeed = right
+        self.motor.send(left, right)
 
-    def goBackCM(self, distance_cm, speed=250):
-        # go back x centimeters
+    def goBackCM(self, distance_cm, speed=250, wait=True):
+        # go back x centimeters, returns the lib.motion.Motion handle
         # 500 motor speed is roughly ~20cm/s
         # default speed=250 (~10cm/s)
+        # wait=False returns while the robot is still reversing
 
-        duration = round(distance_cm / (speed / 25), 0)
-        thympi.setSpeed(-1 * speed, -1 * speed)
-        time.sleep(duration)
-        thympi.setSpeed(0, 0)
-
+        motion = self.motion.reverse(distance_cm, speed, odometry=self.motion_odometry)
+        if wait:
+            motion.wait()
+        return motion
 
-if __name__ == '__main__':
-    # create singleton instance
-    thympi = ThymPi()
 
-    # start video capture
-    cap = cv2.VideoCapture(0)
-    cap.set(3, 640)
-    cap.set(4, 480)
+def run(thympi, grabber, max_encounters=None, retest=None, on_encounter=None):
+    # main control loop: wait for an obstacle, back up, detect it and test its compliance
+    # max_encounters: stop after this many obstacles (None to run forever)
+    # retest: whether to retest objects with a known compliance (None to ask)
+    # on_encounter: called with the object name after every encounter (None if nothing was detected)
+    # returns a list of (object name, seconds from proximity to done) per encounter
+    encounters = []
 
-    while True:
-        if thympi.aseba_network.GetVariable('thymio-II', 'prox.horizontal')[2] > 0:
+    while max_encounters is None or len(encounters) < max_encounters:
+        if thympi.waitForProximity():
             # if center prox detects something, (detection distance ~ 10cm)
             if thympi.verbose:
                 print("object in proximity!")
-
-            objects = []
+            start = time.perf_counter()
 
             # go back 10cm (20cm tends to detect most objects)
-            thympi.goBackCM(10)
+            backoff = thympi.goBackCM(10, wait=False)
 
+            # try detecting on frames captured while reversing, a confident detection there saves waiting
+            # for a frame after the back-off
             thympi.confidence_threshold = 0.5
+            objects = []
+            last_frame = time.perf_counter()
+            while len(objects) == 0 and not backoff.done():
+                success, img, last_frame = grabber.wait(last_frame)
+                if not success:
+                    last_frame = time.perf_counter()
+                    continue
+                objects = thympi.getObjects(img)
+            backoff.wait()
+
+            # otherwise only use frames captured after backing up
+            last_frame = time.perf_counter()
+
+            img = None
+            passes = 0
             while len(objects) == 0:
+                if img is None or thympi.confidence_threshold < thympi.min_confidence_threshold:
+                    # nothing found down to the lowest threshold, start over on a new frame (or burst)
+                    if img is not None:
+                        passes += 1
+                    if passes >= thympi.detection_passes:
+                        break
+                    if thympi.detection_burst > 1:
+                        img, last_frame = grabber.burst(thympi.detection_burst, last_frame)
+                        success = len(img) > 0
+                    else:
+                        success, img, last_frame = grabber.wait(last_frame)
+                    if not success:
+                        img = None
+                        last_frame = time.perf_counter()
+                        continue
+                    thympi.confidence_threshold = 0.5
+
                 if thympi.verbose:
                     print("attempting to detect objects")
-                success, img = cap.read()
                 objects = thympi.getObjects(img)
-                thympi.confidence_threshold -= 0.025  # reduce confidence threshold every time nothing is detected
+                # reduce confidence threshold every time nothing is detected
+                thympi.confidence_threshold = round(thympi.confidence_threshold - 0.025, 3)
+
+            if len(objects) == 0:
+                print("no object detected, skipping this obstacle")
+                if on_encounter is not None:
+                    on_encounter(None)
+                continue
 
             for obj in objects:
-                print("{} detected with {}% confidence".format(obj, objects[obj]))
+                print("{} detected with {:.0f}% confidence".format(obj["name"], obj["confidence"] * 100))
+
+            maxConfObject = str(objects.best()["name"])
 
-            maxConfObject = max(objects, key=objects.get)
+            known_compliance = thympi.compliances.get(maxConfObject)
 
-            if thympi.compliances[maxConfObject] is not None:
-                print("compliance of {} is known to be {}".format(maxConfObject, thympi.compliances[maxConfObject]))
-                tmp = input("do you want to retest the compliance of {}?: ".format(maxConfObject))
-                if tmp == "yes" or tmp == "y":
+            if known_compliance is not None:
+                print("compliance of {} is known to be {}".format(maxConfObject, known_compliance))
+                if retest is None:
+                    tmp = input("do you want to retest the compliance of {}?: ".format(maxConfObject))
+                    retest_object = tmp == "yes" or tmp == "y"
+                else:
+                    retest_object = retest
+                if retest_object:
                     thympi.testCompliance(maxConfObject)
-                elif tmp == "no" or tmp == "n":
-                    pass
-            elif thympi.compliances[maxConfObject] is None:
+            else:
                 if thympi.verbose:
                     print("automatically testing compliance of {}".format(maxConfObject))
-                    thympi.testCompliance(maxConfObject)
+                thympi.testCompliance(maxConfObject)
+
+            encounters.append((maxConfObject, time.perf_counter() - start))
+            thympi.metrics.observe("encounter_seconds", encounters[-1][1],
+                                   "time from proximity to done per obstacle in seconds")
+            thympi.writeMetrics()
+            if on_encounter is not None:
+                on_encounter(maxConfObject)
+
+    return encounters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ThymPi obstacle compliance robot")
+    parser.add_argument("--fake", action="store_true", help="run against simulated hardware (lib/fakes.py)")
+    parser.add_argument("--encounters", type=int, default=None, help="stop after this many obstacles")
+    parser.add_argument("--speedup", type=float, default=1.0, help="simulated world speed with --fake")
+    parser.add_argument("--retest", choices=["ask", "yes", "no"], default="ask",
+                        help="retest objects with a known compliance")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="frames per detection, more than 1 votes over a batched burst")
+    parser.add_argument("--model-variant", default="ssd_mobilenet_v3_large_320", metavar="VARIANT",
+                        help="detection model variant: one of {} or NAME=WEIGHTS,CONFIG[,SIZE] for other model files "
+                             "(e.g. a quantized export)".format(", ".join(sorted(MODEL_VARIANTS))))
+    parser.add_argument("--dnn-backend", choices=sorted(BACKENDS), default="default", help="OpenCV DNN backend")
+    parser.add_argument("--dnn-target", choices=sorted(TARGETS), default="cpu", help="OpenCV DNN target")
+    parser.add_argument("--dnn-threads", type=int, default=None, help="OpenCV thread count (default: OpenCV's)")
+    parser.add_argument("--detection-cache", type=int, default=16,
+                        help="cached detection results for similar frames (0 to always run inference)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run the asyncio control loop (lib/orchestrator.py), which overlaps stages")
+    parser.add_argument("--quiet", action="store_true", help="don't print progress")
+    args = parser.parse_args()
+    try:
+        parseVariant(args.model_variant)
+    except ValueError as error:
+        parser.error(str(error))
+
+    retest = {"ask": None, "yes": True, "no": False}[args.retest]
+    on_encounter = None
+    detection = {"detection_burst": args.burst, "model_variant": args.model_variant, "dnn_backend": args.dnn_backend,
+                 "dnn_target": args.dnn_target, "dnn_threads": args.dnn_threads,
+                 "detection_cache_size": args.detection_cache}
+
+    if args.fake:
+        from lib.fakes import FakeWorld
+
+        world = FakeWorld(speedup=args.speedup)
+        devices, cap = world.devices()
+        thympi = ThymPi(verbose=not args.quiet, compliances={}, **detection, **devices)
+        on_encounter = lambda name: world.nextObstacle()
+    else:
+        # create singleton instance
+        thympi = ThymPi(verbose=not args.quiet, **detection)
+
+        # start video capture
+        cap = cv2.VideoCapture(0)
+        cap.set(3, 640)
+        cap.set(4, 480)
+
+    # keep reading frames in the background so detection always sees the newest one
+    grabber = FrameGrabber(cap, thympi.metrics)
+    grabber.start()
+
+    start = time.perf_counter()
+    try:
+        if args.use_async:
+            from lib.orchestrator import runAsync
+            encounters = runAsync(thympi, grabber, args.encounters, retest, on_encounter)
+        else:
+            encounters = run(thympi, grabber, args.encounters, retest, on_encounter)
+    finally:
+        thympi.setSpeed(0, 0)
+        thympi.motor.stop()
+        grabber.stop()
+        # commit measurements still queued in the compliance store
+        if hasattr(thympi.compliances, "close"):
+            thympi.compliances.close()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(duration for name, duration in encounters)
+    print("handled {} obstacles in {:.2f}s ({:.2f} per minute)".format(len(encounters), elapsed,
+                                                                      60 * len(encounters) / elapsed))
+    if len(latencies) > 0:
+        print("encounter latency: median {:.2f}s, max {:.2f}s".format(latencies[len(latencies) // 2], latencies[-1]))
@@ -0,0 +1,56 @@
+# replay recorded compliance test traces through ThymPi.testCompliance
+# traces are written by running ThymPi with record_dir set (see lib/trace.py)
+# usage: python3 replay.py [--realtime] [--verbose] trace [trace ...]
+
+import argparse
+import time
+
+import numpy as np
+
+from analyse import traceCalibration
+from lib.trace import ReplayClock, ReplayNetwork, ReplaySensor, Trace
+from main import ThymPi
+
+
+def replayTrace(path, realtime=False, verbose=False):
+    # run one compliance test against a trace, returns (class_name, recorded compliance, replayed compliance)
+    # the test starts at the first recorded forward motor target with the recorded calibration, traces without
+    # motor targets are calibrated and tested from their start
+    trace = Trace(path)
+    start, calibration = trace.start, None
+    if trace.test_start is not None:
+        start = trace.test_start
+        calibration = traceCalibration(trace, int(np.searchsorted(trace.stream("accel")["t"], start)))
+    clock = ReplayClock(start, realtime)
+
+    thympi = ThymPi(sensor=ReplaySensor(trace, clock),
+                    aseba_network=ReplayNetwork(trace, clock),
+                    clock=clock,
+                    load_model=False,
+                    verbose=verbose,
+                    compliances={},
+                    startup_report=False)
+
+    class_name = trace.meta.get("class_name", "unknown")
+    try:
+        thympi.testCompliance(class_name, calibration)
+    finally:
+        thympi.motor.stop()
+
+    return class_name, trace.meta.get("compliance"), thympi.compliances[class_name]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay recorded compliance tests")
+    parser.add_argument("traces", nargs="+", help="trace files to replay")
+    parser.add_argument("--realtime", action="store_true", help="replay at recorded speed instead of as fast as possible")
+    parser.add_argument("--verbose", action="store_true", help="print ThymPi output")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    for path in args.traces:
+        class_name, recorded, replayed = replayTrace(path, args.realtime, args.verbose)
+        print("{} | class: {} | recorded: {} | replayed: {}".format(path, class_name, recorded, replayed))
+
+    print("replayed {} traces in {:.3f}s".format(len(args.traces), time.perf_counter() - start))
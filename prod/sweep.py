@@ -0,0 +1,194 @@
+# sweep calcCompliance parameters over labeled compliance test traces
+# every combination of noise floor (multiple of the calibration error range c_error), weight profile and maxWavg
+# is scored by how well it separates soft from hard objects
+# testCompliance's noise floor is 2 * (c_error - c_mean) rather than a multiple of c_error, the sweep reports what
+# multiple of c_error that is on the traces (negative when the calibration mean is larger than its error range)
+# segmentation depends on the noise floor only, so traces are segmented once per noise floor (in a process pool),
+# reduced to per weight position sums and every (weight profile, maxWavg) pair is then scored in one broadcast
+# usage: python3 sweep.py --soft "teddy bear" --soft "sports ball" [--hard cup] [--output sweep.csv] traces [...]
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analyse import TableWriter, chunks, findTraces, testWindow, traceCalibration
+from lib import compliance
+from lib.segmenter import CollisionSegmenter
+from lib.trace import Trace
+
+COLUMNS = ["noise_floor", "profile", "max_wavg", "auc", "margin", "gap", "soft_mean", "hard_mean"]
+
+
+def weightProfiles(count):
+    # (names, count x len(weights) matrix): the current weights, uniform weights and exponential decays,
+    # every profile has the same total weight as the current one so maxWavg keeps its meaning
+    positions = np.arange(len(compliance.weights))
+    total = compliance.weights.sum()
+    decays = np.linspace(0.05, 3, max(count - 2, 0))
+
+    profiles = np.vstack([compliance.weights, np.ones(len(positions)), np.exp(-np.outer(decays, positions))])
+    profiles *= total / profiles.sum(axis=1, keepdims=True)
+    names = ["default", "uniform"] + ["exp({:.3f})".format(decay) for decay in decays]
+    return names, profiles
+
+
+def positionSums(event):
+    # sum of the event's values per weight position (as weightPositions assigns them) divided by the event length,
+    # so that wAvg(event) == positionSums(event) @ weights
+    values = np.sort(np.abs(np.asarray(event, dtype=float)))[::-1]
+    n = len(compliance.weights)
+    if values.size == 0:
+        return np.zeros(n)
+    position = np.minimum(np.rint(np.arange(values.size) / values.size * n).astype(int), n - 1)
+    return np.bincount(position, weights=values, minlength=n) / values.size
+
+
+def traceSums(path, noise_floors, test_duration=2, settle_samples=25):
+    # (class name, (c_mean, c_error), noise floors x weight positions) position sums of the event calcCompliance
+    # picks for every noise floor multiple of c_error, a row of zeros if there is no decel event (full compliance)
+    trace = Trace(path)
+    x = trace.stream("accel")["x"]
+    start, end = testWindow(trace, test_duration)
+    c_mean, c_error = traceCalibration(trace, start)
+
+    sums = np.zeros((len(noise_floors), len(compliance.weights)))
+    for row, noise_floor in enumerate(noise_floors):
+        # segmented like testCompliance (stops at the first closed collision decel event)
+        segmenter = CollisionSegmenter(noise_floor * c_error, settle_samples=settle_samples)
+        for chunk in chunks(x, start, end):
+            if any(segmenter.update(value) for value in (chunk.astype(float) - c_mean).tolist()):
+                break
+        segmenter.close()
+
+        # largest event by get2Dsize, the last one wins on ties
+        events = [event for event in segmenter.decel_events if len(event) > 0]
+        if len(events) > 0:
+            sizes = [compliance.get2Dsize(event) for event in events]
+            chosen = len(sizes) - 1 - int(np.argmax(sizes[::-1]))
+            sums[row] = positionSums(events[chosen])
+
+    return trace.meta.get("class_name", "unknown"), (c_mean, c_error), sums
+
+
+def currentMultiples(calibrations):
+    # testCompliance's noise floor 2 * (c_error - c_mean) as a multiple of c_error, per (c_mean, c_error)
+    c_mean, c_error = np.asarray(calibrations, dtype=float).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(c_error > 0, 2 * (c_error - c_mean) / c_error, np.nan)
+
+
+def sweepCompliances(sums, profiles, max_wavgs):
+    # traces x noise floors x profiles x maxWavgs compliances from traces x noise floors x weight positions sums
+    w_avg = np.einsum("tfl,pl->tfp", sums, profiles)
+    return np.maximum(1.0 - w_avg[..., np.newaxis] / np.asarray(max_wavgs, dtype=float), 0)
+
+
+def separation(soft, hard):
+    # per parameter set scores of soft (soft traces x ...) against hard (hard traces x ...) compliances:
+    #   auc: probability that a soft trace scores a higher compliance than a hard one (ties count half)
+    #   margin: lowest soft minus highest hard compliance, > 0 if a threshold separates them perfectly
+    #   gap: mean soft minus mean hard compliance
+    wins = np.zeros(soft.shape[1:])
+    for compliances in soft:
+        wins += (compliances > hard).sum(axis=0) + 0.5 * (compliances == hard).sum(axis=0)
+    return {"auc": wins / (len(soft) * len(hard)),
+            "margin": soft.min(axis=0) - hard.max(axis=0),
+            "gap": soft.mean(axis=0) - hard.mean(axis=0),
+            "soft_mean": soft.mean(axis=0),
+            "hard_mean": hard.mean(axis=0)}
+
+
+def ranking(scores):
+    # flat parameter set indices, best first: highest auc, then widest margin, then widest gap
+    return np.lexsort((-scores["gap"].ravel(), -scores["margin"].ravel(), -scores["auc"].ravel()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sweep compliance parameters over labeled traces")
+    parser.add_argument("traces", nargs="+", help="trace files or directories of trace files")
+    parser.add_argument("--soft", action="append", default=[], metavar="CLASS", help="a soft object, can be repeated")
+    parser.add_argument("--hard", action="append", default=[], metavar="CLASS",
+                        help="a hard object, can be repeated (default: every object that isn't soft)")
+    parser.add_argument("--noise-floors", type=float, nargs=3, default=[0.5, 6, 23], metavar=("MIN", "MAX", "N"),
+                        help="noise floors as multiples of the calibration error range (c_error)")
+    parser.add_argument("--profiles", type=int, default=435, help="weight profiles")
+    parser.add_argument("--max-wavgs", type=float, nargs=3, default=[1, 10, 10], metavar=("MIN", "MAX", "N"),
+                        help="maxWavg values")
+    parser.add_argument("--output", default=None, help="every parameter set's scores (.csv or .parquet)")
+    parser.add_argument("--top", type=int, default=10, help="parameter sets to print")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--test-duration", type=float, default=2, help="compliance test duration (seconds)")
+    parser.add_argument("--settle-samples", type=int, default=25, help="quiet samples that end a decel event")
+    args = parser.parse_args()
+
+    paths = findTraces(args.traces)
+    if len(paths) == 0:
+        parser.error("no traces found")
+    if len(args.soft) == 0:
+        parser.error("no soft objects, use --soft")
+
+    noise_floors = np.linspace(args.noise_floors[0], args.noise_floors[1], int(args.noise_floors[2]))
+    names, profiles = weightProfiles(args.profiles)
+    max_wavgs = np.linspace(args.max_wavgs[0], args.max_wavgs[1], int(args.max_wavgs[2]))
+
+    # open the output first, a bad path fails before the sweep rather than after it
+    table = TableWriter(args.output, COLUMNS) if args.output is not None else None
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(traceSums, path, noise_floors, args.test_duration, args.settle_samples)
+                   for path in paths]
+        results = [future.result() for future in futures]
+    segmented = time.perf_counter()
+
+    class_names = np.array([class_name for class_name, _, _ in results])
+    calibrations = [calibration for _, calibration, _ in results]
+    sums = np.stack([trace_sums for _, _, trace_sums in results])
+    soft = np.isin(class_names, args.soft)
+    hard = np.isin(class_names, args.hard) if len(args.hard) > 0 else ~soft
+    if not soft.any() or not hard.any():
+        parser.error("need traces of both soft and hard objects, found: {}".format(", ".join(sorted(set(class_names)))))
+
+    compliances = sweepCompliances(sums, profiles, max_wavgs)
+    scores = separation(compliances[soft], compliances[hard])
+    order = ranking(scores)
+    scored = time.perf_counter()
+
+    shape = scores["auc"].shape
+    print("{} traces ({} soft, {} hard), {} parameter sets ({} noise floors x {} profiles x {} maxWavgs)".format(
+        len(paths), soft.sum(), hard.sum(), scores["auc"].size, *shape))
+    print("segmented in {:.2f}s, scored in {:.2f}s".format(segmented - start, scored - segmented))
+
+    def describe(index):
+        f, p, m = np.unravel_index(index, shape)
+        return "noise floor {:.2f}, weights {}, maxWavg {:.2f}: auc {:.3f}, margin {:.3f}, gap {:.3f}".format(
+            noise_floors[f], names[p], max_wavgs[m], scores["auc"][f, p, m], scores["margin"][f, p, m],
+            scores["gap"][f, p, m])
+
+    for rank, index in enumerate(order[:args.top]):
+        print("{}. {}".format(rank + 1, describe(index)))
+
+    # the parameters testCompliance currently uses: its noise floor as a multiple of c_error varies per trace,
+    # the grid point nearest the median stands in for it if the median is inside the grid
+    multiples = currentMultiples(calibrations)
+    if np.isnan(multiples).all():
+        print("current noise floor 2 * (c_error - c_mean): no trace has a calibration error range")
+    else:
+        median = float(np.nanmedian(multiples))
+        print("current noise floor 2 * (c_error - c_mean): {:.2f} to {:.2f} x c_error (median {:.2f}), "
+              "negative on {} of {} traces".format(np.nanmin(multiples), np.nanmax(multiples), median,
+                                                   int((multiples < 0).sum()), len(multiples)))
+        current = np.flatnonzero(np.isclose(max_wavgs, compliance.maxWavg))
+        if noise_floors.min() <= median <= noise_floors.max() and len(current) > 0:
+            index = np.ravel_multi_index((int(np.argmin(np.abs(noise_floors - median))), 0, current[0]), shape)
+            print("current: {} (rank {})".format(describe(index), int(np.flatnonzero(order == index)[0]) + 1))
+
+    if table is not None:
+        f, p, m = np.unravel_index(order, shape)
+        for row in zip(noise_floors[f].tolist(), np.array(names)[p].tolist(), max_wavgs[m].tolist(),
+                       *(scores[key].ravel()[order].tolist() for key in COLUMNS[3:])):
+            table.write(dict(zip(COLUMNS, row)))
+        table.close()
+        print("results in {}".format(args.output))
@@ -0,0 +1,161 @@
+# microbenchmarks for the compliance and calibration pipeline
+# runs on synthetic accelerometer traces, no hardware needed
+# usage: python3 bench_compliance.py [--output bench_results.json] [--compare old_results.json]
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(root, "prod"))
+sys.path.insert(0, os.path.join(root, "tests"))
+
+from lib.compliance import calcCompliance, calcCompliances, wAvg
+from lib.sampler import IMUSampler
+from lib.segmenter import CollisionSegmenter
+from lib.stats import StableEstimate
+from compliance_test import analyseFrames, frame_size, getCompliance
+
+lengths = [1000, 10000, 100000]  # readings per trace
+noise_levels = [0.05, 0.2, 0.5]  # standard deviation of sensor noise (m/s^2)
+rate = 1000  # synthetic sample rate (Hz)
+
+
+def syntheticTrace(length, noise, seed=0):
+    # flat readings with a drive-off accel bump, a collision decel at 60% and a small rebound
+    rng = np.random.default_rng(seed)
+    xs = rng.normal(0.0, noise, length)
+
+    start = length // 10
+    xs[start:start + length // 20] += 2.0
+
+    collision = int(length * 0.6)
+    width = max(length // 50, 5)
+    xs[collision:collision + width] -= 8.0 * np.hanning(width)
+    xs[collision + width:collision + 2 * width] += 2.0 * np.hanning(width)
+
+    return xs
+
+
+class ArraySource:
+    # sampler source that hands out a prerecorded trace in poll sized chunks
+    poll_interval = 0
+    buffered = True
+
+    def __init__(self, xs, chunk=10):
+        self.xs = xs
+        self.t = np.arange(len(xs)) / rate
+        self.chunk = chunk
+        self.cursor = 0
+
+    def drain(self):
+        start, self.cursor = self.cursor, min(self.cursor + self.chunk, len(self.xs))
+        return self.t[start:self.cursor], self.xs[start:self.cursor]
+
+
+def benchCalibration(xs):
+    # calibrateSensor statistics: feed sampler chunks into the online estimate (without the early stop)
+    sampler = IMUSampler(ArraySource(xs), capacity=len(xs))
+    estimate = StableEstimate()
+    mark = 0
+    while mark < len(xs):
+        t, readings, mark = sampler.read(mark)
+        estimate.updateMany(readings)
+    return estimate.mean, estimate.halfRange
+
+
+def benchSegmentation(xs):
+    # accel/decel segmentation of testCompliance over the whole trace
+    segmenter = CollisionSegmenter(0.5)
+    for x in xs.tolist():
+        segmenter.update(x)
+    segmenter.close()
+    return segmenter
+
+
+def benchLegacyFrames(xs):
+    # frame analysis and getCompliance of tests/compliance_test.py
+    accel_events, decel_events = analyseFrames(xs.tolist(), 0.0, 0.5, frame_size)
+    return getCompliance(decel_events)
+
+
+def timeit(function, *args, repeat=5):
+    # run function repeat times, returns (min, median) seconds per call
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=root, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmarks(repeat=5):
+    results = []
+
+    def record(name, length, noise, function, *args):
+        best, median = timeit(function, *args, repeat=repeat)
+        results.append({"name": name, "length": length, "noise": noise, "repeat": repeat,
+                        "min": best, "median": median})
+        print("{:<24} length: {:<7} noise: {:<5} min: {:.6f}s median: {:.6f}s".format(name, length, noise, best, median))
+
+    for length in lengths:
+        for noise in noise_levels:
+            xs = syntheticTrace(length, noise)
+            segmenter = benchSegmentation(xs)
+            decel_events = segmenter.decel_events
+            largest = sorted(np.abs(np.concatenate(decel_events)).tolist(), reverse=True) if decel_events else [0.0]
+
+            record("calibration", length, noise, benchCalibration, xs)
+            record("segmentation", length, noise, benchSegmentation, xs)
+            record("calcCompliance", length, noise, calcCompliance, segmenter.accel_events, decel_events)
+            record("calcCompliances x100", length, noise, calcCompliances, [decel_events] * 100)
+            record("wAvg", length, noise, wAvg, largest)
+            record("legacy frames", length, noise, benchLegacyFrames, xs)
+
+    return results
+
+
+def compare(results, old_path):
+    # print median ratios against an earlier results file, > 1 means slower than before
+    with open(old_path) as f:
+        old = {(r["name"], r["length"], r["noise"]): r for r in json.load(f)["results"]}
+
+    for r in results:
+        key = (r["name"], r["length"], r["noise"])
+        if key in old and old[key]["median"] > 0:
+            print("{:<24} length: {:<7} noise: {:<5} ratio: {:.2f}".format(*key, r["median"] / old[key]["median"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compliance pipeline microbenchmarks")
+    parser.add_argument("--output", default="bench_results.json", help="file to write results to")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.repeat)
+
+    with open(args.output, "w") as f:
+        json.dump({"commit": gitCommit(),
+                   "python": platform.python_version(),
+                   "numpy": np.__version__,
+                   "machine": platform.machine(),
+                   "timestamp": time.time(),
+                   "results": results}, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
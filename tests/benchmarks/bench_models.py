@@ -0,0 +1,117 @@
+# latency/accuracy benchmark of detection model variants, backends and targets
+# runs every variant over a directory of stored images and compares its detections to a reference variant
+# usage: python3 bench_models.py images/ [--variants a b ...] [--backend opencv] [--target cpu] [--threads 4]
+# variants are MODEL_VARIANTS names or name=weights,config[,size] for other model files, e.g. to compare a quantized
+# export: --variants ssd_mobilenet_v3_large_320 ssd_int8=ssd_int8.pb,ssd_int8.pbtxt,320
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(root, "prod"))
+
+from lib.detection import BACKENDS, MODEL_VARIANTS, TARGETS, loadDetectionModel, parseVariant
+
+
+def loadImages(directory):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        img = cv2.imread(os.path.join(directory, name))
+        if img is not None:
+            images.append((name, img))
+    return images
+
+
+def runVariant(net, images, conf_threshold, nms_threshold):
+    # returns per-image latencies (seconds) and detections as {class id: best confidence}
+    net.detect(images[0][1], confThreshold=conf_threshold, nmsThreshold=nms_threshold)  # warm up
+
+    latencies = []
+    detections = []
+    for name, img in images:
+        start = time.perf_counter()
+        classIds, confs, bbox = net.detect(img, confThreshold=conf_threshold, nmsThreshold=nms_threshold)
+        latencies.append(time.perf_counter() - start)
+
+        found = {}
+        for class_id, conf in zip(np.array(classIds).flatten().tolist(), np.array(confs).flatten().tolist()):
+            found[class_id] = max(conf, found.get(class_id, 0.0))
+        detections.append(found)
+
+    return latencies, detections
+
+
+def agreement(detections, reference):
+    # top-1 class agreement and mean class set jaccard index against the reference detections
+    top1 = []
+    jaccard = []
+    for found, expected in zip(detections, reference):
+        best = max(found, key=found.get) if found else None
+        best_expected = max(expected, key=expected.get) if expected else None
+        top1.append(best == best_expected)
+
+        union = set(found) | set(expected)
+        jaccard.append(len(set(found) & set(expected)) / len(union) if union else 1.0)
+
+    return float(np.mean(top1)), float(np.mean(jaccard))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="detection model latency/accuracy benchmark")
+    parser.add_argument("images", help="directory of stored camera frames")
+    parser.add_argument("--variants", nargs="+", default=list(MODEL_VARIANTS), metavar="VARIANT",
+                        help="MODEL_VARIANTS names or NAME=WEIGHTS,CONFIG[,SIZE] for other model files")
+    parser.add_argument("--reference", default="ssd_mobilenet_v3_large_320", metavar="VARIANT",
+                        help="variant the others are compared to, in the same form as --variants")
+    parser.add_argument("--backend", default="default", choices=list(BACKENDS))
+    parser.add_argument("--target", default="cpu", choices=list(TARGETS))
+    parser.add_argument("--threads", type=int, default=None, help="OpenCV thread count")
+    parser.add_argument("--conf", type=float, default=0.5, help="confidence threshold")
+    parser.add_argument("--nms", type=float, default=0.2, help="nms threshold")
+    parser.add_argument("--bin", default=os.path.join(root, "prod", "bin"), help="directory with the model files")
+    parser.add_argument("--output", default="model_results.json", help="file to write results to")
+    args = parser.parse_args()
+
+    images = loadImages(args.images)
+    if len(images) == 0:
+        sys.exit("no images found in {}".format(args.images))
+
+    variants = [args.reference] + [variant for variant in args.variants if variant != args.reference]
+    try:
+        variants = [parseVariant(variant) for variant in variants]
+    except ValueError as error:
+        parser.error(str(error))
+    results = []
+    reference = None
+
+    for variant, files in variants:
+        try:
+            net = loadDetectionModel(args.bin, variant, args.backend, args.target, args.threads, **files)
+        except (OSError, cv2.error) as error:
+            print("{}: could not load ({})".format(variant, str(error).strip().splitlines()[-1]))
+            continue
+
+        latencies, detections = runVariant(net, images, args.conf, args.nms)
+        if reference is None:
+            reference = detections
+
+        top1, jaccard = agreement(detections, reference)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        results.append({"variant": variant, "files": files, "images": len(images),
+                        "mean": float(np.mean(latencies)), "p50": float(p50), "p90": float(p90), "p99": float(p99),
+                        "top1_agreement": top1, "class_jaccard": jaccard})
+
+        print("{:<28} p50: {:.4f}s p90: {:.4f}s p99: {:.4f}s top1: {:.2f} jaccard: {:.2f}".format(
+            variant, p50, p90, p99, top1, jaccard))
+
+    with open(args.output, "w") as f:
+        json.dump({"backend": args.backend, "target": args.target, "threads": args.threads,
+                   "opencv": cv2.__version__, "machine": platform.machine(), "reference": args.reference,
+                   "conf_threshold": args.conf, "nms_threshold": args.nms, "results": results}, f, indent=2)
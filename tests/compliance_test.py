@@ -1,66 +1,79 @@
 # library with compliance testing functions and automated compliance testing script
 
-import time
 import os
-import dbus
-import dbus.mainloop.glib
-from mpu6050 import mpu6050
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prod"))
+
+from lib.scheduler import DeadlineSampler
+from lib.segmenter import FrameSegmenter
 
 frame_size = 50  # number of readings per frame, 50 seems to work for most cases
+rate = 1000  # sample rate (Hz), readings are taken on a fixed deadline schedule
 
 
-def calibrate(sensor, seconds, verbose):
-    xs = []
+def makeSampler(sensor, seconds):
+    # deadline sampler with room for seconds of readings
+    return DeadlineSampler(lambda: sensor.get_accel_data()["x"], rate, capacity=int(seconds * rate) + 1)
 
-    start = time.time()
-    end = time.time() + seconds
 
-    while time.time() <= end: xs.append(sensor.get_accel_data()["x"])
+def printSamplingStats(sampler):
+    stats = sampler.stats()
+    print("""sampling: {} readings at {} Hz (target {} Hz)
+jitter: {} s, max lateness: {} s, missed deadlines: {}""".format(
+        stats["samples"], stats["rate"], stats["target_rate"], stats["jitter"], stats["lateness_max"], stats["missed"]))
+
+
+def calibrate(sensor, seconds, verbose):
+    sampler = makeSampler(sensor, seconds)
+    t, xs = sampler.run(seconds)
 
-    avg = sum(xs) / len(xs)
-    error = (max(xs) - min(xs)) / 2
+    avg = xs.mean()
+    error = (xs.max() - xs.min()) / 2
 
     if verbose:
         print("""calibration results: 
 average value: {}
 error range +-: {}
 data points: {}""".format(avg, error, len(xs)))
+        printSamplingStats(sampler)
 
     return avg, error
 
 
-def read_test(sensor, seconds, frame_size, verbose):
+def read_test(sensor, seconds, frame_size, verbose, sliding=False):
     # read sensor values and analyse them as frames
     # seconds to run loop
     # verbose to print to console, noverbose for return 
-
-    xs = []
-    i = 0
+    # sliding to analyse the last frame_size readings after every reading instead of once per frame
 
     # perform calibration at start
     c_mean, c_error = calibrate(sensor, 1, verbose)
     noise_floor = round(c_error - c_mean, 2)
 
-    start = time.time()
-    end = start + seconds
+    sampler = makeSampler(sensor, seconds)
+    segmenter = FrameSegmenter(noise_floor, frame_size, sliding)
+
+    sampler.deadlines.start()
+    end = sampler.deadlines.next + int(seconds * 1e9)
+
+    while sampler.deadlines.next <= end:
+        # normalize with calibration average, the segmenter keeps the mean of the last frame
+        event = segmenter.update(sampler.sample() - c_mean)
 
-    while (time.time() <= end):
-        xs.append(sensor.get_accel_data()["x"])
-        i += 1
+        # use calibrated error to ignore noise
+        if event is not None:
+            print("{} event: {}".format(*event))
 
-        # only perform calculations every time frame size is reached
-        if i % frame_size == 0 and i > frame_size:
-            # take average of readings in last frame and normalize with calibration average
-            avg_lastx = (sum(xs[-frame_size:]) / len(xs[-frame_size:])) - c_mean
+    event = segmenter.close()
+    if event is not None:
+        print("{} event: {}".format(*event))
 
-            # use calibrated error to ignore noise
-            if avg_lastx > noise_floor:
-                print("accel event: " + str(avg_lastx))
-            elif avg_lastx < (-1 * noise_floor):
-                print("decel event: " + str(avg_lastx))
+    if verbose:
+        printSamplingStats(sampler)
 
 
-def compliance_test(object_class, sensor, aseba_network, verbose):
+def compliance_test(object_class, sensor, aseba_network, verbose, sliding=False):
     # around -1g for complete stop
     # TODO: start from ~10cm out (can be changed)
     # return first collision decel
@@ -71,59 +84,63 @@ def compliance_test(object_class, sensor, aseba_network, verbose):
 
     asebaNetwork.SendEventName('motor.target', [500, 500])
 
-    xs = []
-    accel_events = []
-    decel_events = []
-    i = 0
-
-    start = time.time()
-    end = start + 2
+    seconds = 2
+    sampler = makeSampler(sensor, seconds)
+    segmenter = FrameSegmenter(noise_floor, frame_size, sliding)
 
-    while (time.time() <= end):
-        xs.append(sensor.get_accel_data()["x"])
-        i += 1
+    sampler.deadlines.start()
+    end = sampler.deadlines.next + int(seconds * 1e9)
 
-        # only perform calculations every time frame size is reached
-        if i % frame_size == 0 and i > frame_size:
-            # take average of readings in last frame and normalize with calibration average
-            avg_lastx = (sum(xs[-frame_size:]) / len(xs[-frame_size:])) - c_mean
+    while sampler.deadlines.next <= end:
+        # normalize with calibration average, the segmenter keeps the mean of the last frame
+        # and uses the calibrated error to ignore noise
+        event = segmenter.update(sampler.sample() - c_mean)
+        if verbose and event is not None:
+            print("{} event: {}".format(*event))
 
-            # use calibrated error to ignore noise
-            if avg_lastx > noise_floor:
-                if verbose: print("accel event: " + str(avg_lastx))
-                accel_events.append(avg_lastx)
-            elif avg_lastx < (-1 * noise_floor):
-                if verbose: print("decel event: " + str(avg_lastx))
-                decel_events.append(avg_lastx)
+    segmenter.close()
+    decel_events = segmenter.decel_events
 
     asebaNetwork.SendEventName('motor.target', [0, 0])
 
-    # defining compliance
-    # first decel is most important (collision event)
-    # multiple deceleration events suggests object is moving but putting up resistance in movement
+    compliance = getCompliance(decel_events)
 
-    def getCompliance(decel_events):
-        # calculate compliance from deceleration events
-        compliance = 1.0
+    if verbose:
+        print("""decels: {}\ncompliance: {}""".format(decel_events, compliance))
+        printSamplingStats(sampler)
 
-        if len(decel_events) == 0:
-            # no deceleration detected, assume full compliance, pass
-            pass
-        else:
-            for i in range(len(decel_events)):
-                compliance = compliance - abs(decel_events[i] / (i + 1))
-        if compliance < 0: compliance = 0  # cap compliance at 0
+    return compliance
 
-        return compliance
 
-    compliance = getCompliance(decel_events)
+# defining compliance
+# first decel is most important (collision event)
+# multiple deceleration events suggests object is moving but putting up resistance in movement
 
-    if verbose:
-        print("""decels: {}\ncompliance: {}""".format(decel_events, compliance))
+def getCompliance(decel_events):
+    # calculate compliance from deceleration events
+    compliance = 1.0
+
+    if len(decel_events) == 0:
+        # no deceleration detected, assume full compliance, pass
+        pass
+    else:
+        for i in range(len(decel_events)):
+            compliance = compliance - abs(decel_events[i] / (i + 1))
+    if compliance < 0: compliance = 0  # cap compliance at 0
 
     return compliance
 
 
+def analyseFrames(xs, c_mean, noise_floor, frame_size, sliding=False):
+    # offline version of the frame analysis in compliance_test, for recorded readings
+    segmenter = FrameSegmenter(noise_floor, frame_size, sliding)
+    for x in xs:
+        segmenter.update(x - c_mean)
+    segmenter.close()
+
+    return segmenter.accel_events, segmenter.decel_events
+
+
 def dbusReply(reply):
     return reply
 
@@ -133,6 +150,10 @@ def dbusError(error):
 
 
 if __name__ == "__main__":
+    import dbus
+    import dbus.mainloop.glib
+    from mpu6050 import mpu6050
+
     # test module
     sensor = mpu6050(0x68)
 
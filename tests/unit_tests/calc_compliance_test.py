@@ -0,0 +1,81 @@
+# calcCompliance / calcCompliances against a plain loop over segmented synthetic collisions
+
+import numpy as np
+import pytest
+
+from lib import compliance
+from lib.segmenter import CollisionSegmenter
+
+
+def referenceCompliance(decel_events):
+    # the largest event by get2Dsize (the last one on ties), its absolute values largest first,
+    # weighted by their relative position in the event
+    chosen = None
+    max_size = None
+    for event in decel_events:
+        if len(event) == 0:
+            continue
+        size = max(abs(x) for x in event) * len(event)
+        if max_size is None or size >= max_size:
+            chosen, max_size = event, size
+    if chosen is None:
+        return 1.0
+
+    values = sorted((abs(x) for x in chosen), reverse=True)
+    total = 0.0
+    for i, value in enumerate(values):
+        position = min(int(round(i / len(values) * len(compliance.weights))), len(compliance.weights) - 1)
+        total += value * compliance.weights[position]
+    return max(1.0 - total / len(values) / compliance.maxWavg, 0.0)
+
+
+def collisions(rng, count, length=2000, noise=0.05, end=False):
+    # noise with count decelerations of random depth and duration, the last one runs into the end of the window
+    x = rng.normal(0.0, noise, length)
+    starts = np.sort(rng.choice(np.arange(100, length - 300, 150), count, replace=False))
+    for start in starts:
+        x[start:start + rng.integers(5, 120)] -= rng.uniform(0.5, 6.0)
+    if end:
+        x[-40:] -= rng.uniform(0.5, 6.0)
+    return x
+
+
+def segment(x, noise_floor=0.2):
+    segmenter = CollisionSegmenter(noise_floor, settle_samples=25)
+    for value in x.tolist():
+        segmenter.update(value)
+    segmenter.close()
+    return segmenter.decel_events
+
+
+@pytest.fixture
+def tests():
+    rng = np.random.default_rng(3)
+    signals = [collisions(rng, count, end=end) for count in (1, 2, 4, 8) for end in (False, True)]
+    # no decelerations at all
+    signals.append(rng.normal(0.0, 0.05, 2000))
+    return [segment(x) for x in signals]
+
+
+def test_calc_compliance_matches_reference(tests):
+    for decel_events in tests:
+        assert compliance.calcCompliance([], decel_events) == pytest.approx(referenceCompliance(decel_events))
+
+
+def test_calc_compliances_matches_reference(tests):
+    # the deceleration still open at the end of the window is an event too (it starts on its second sample)
+    assert len(tests[1][-1]) == 39
+    assert tests[-1] == []
+    expected = [referenceCompliance(decel_events) for decel_events in tests]
+    assert compliance.calcCompliances(tests) == pytest.approx(expected)
+    assert compliance.calcCompliances([]).shape == (0,)
+
+
+def test_largest_event_wins_over_the_last():
+    small, large = [-0.5, -0.6], [-1.0, -1.2, -1.1]
+    assert compliance.calcCompliance([], [large, small]) == pytest.approx(referenceCompliance([large]))
+    # equal sizes (peak x length), the last one wins
+    flat, peaked = [-0.4, -0.4], [-0.1, -0.4]
+    assert compliance.calcCompliance([], [flat, peaked]) == pytest.approx(referenceCompliance([peaked]))
+    assert compliance.calcCompliance([], [peaked, flat]) == pytest.approx(referenceCompliance([flat]))
+    assert referenceCompliance([flat]) != pytest.approx(referenceCompliance([peaked]))
@@ -0,0 +1,11 @@
+# pytest setup for the unit tests, run with: python3 -m pytest tests/unit_tests
+
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(root, "prod"))
+sys.path.insert(0, os.path.join(root, "tests"))
+
+# hardware test scripts, they drive real devices when imported
+collect_ignore = ["cam_test.py", "imu_test.py", "thymio_test.py", "preprogrammed.py"]
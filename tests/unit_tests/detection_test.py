@@ -0,0 +1,49 @@
+# voting on the detections of a burst of frames, model variant arguments
+
+import numpy as np
+import pytest
+
+from lib.detection import loadDetectionModel, parseVariant, voteDetections
+
+
+def frame(*detections):
+    # (classIds, confs, bbox) of a frame from (class id, confidence) pairs, every box at the origin
+    classIds = np.array([class_id for class_id, confidence in detections], dtype=int)
+    confs = np.array([confidence for class_id, confidence in detections], dtype=np.float32)
+    return classIds, confs, np.zeros((len(detections), 4), dtype=int)
+
+
+def test_all_empty_burst():
+    classIds, confs, bbox = voteDetections([frame(), frame(), frame()], 0.5)
+    assert (classIds.shape, confs.shape, bbox.shape) == ((0,), (0,), (0, 4))
+
+
+def test_burst_with_empty_frames():
+    # the cup is averaged over all three frames, empty ones count as 0
+    classIds, confs, bbox = voteDetections([frame(), frame((47, 0.9), (47, 0.6)), frame((47, 0.9))], 0.5)
+    assert classIds.tolist() == [47]
+    assert confs == pytest.approx([0.6])
+    assert bbox.shape == (1, 4)
+
+    # seen in one frame only, not consistently enough
+    classIds, confs, bbox = voteDetections([frame(), frame((47, 0.9)), frame()], 0.5)
+    assert len(classIds) == 0 and bbox.shape == (0, 4)
+
+
+def test_parse_variant():
+    assert parseVariant("ssd_mobilenet_v3_large_256") == ("ssd_mobilenet_v3_large_256", {})
+    assert parseVariant("int8=q.pb,q.pbtxt,300") == ("int8", {"weights": "q.pb", "config": "q.pbtxt",
+                                                              "input_size": (300, 300)})
+    assert parseVariant("int8=q.pb,q.pbtxt")[1]["input_size"] == (320, 320)
+    for text in ("ssd", "int8=q.pb", "=q.pb,q.pbtxt", "int8=q.pb,q.pbtxt,large"):
+        with pytest.raises(ValueError):
+            parseVariant(text)
+
+
+def test_load_other_model_files(tmp_path):
+    # a variant that isn't built in loads the given files
+    name, files = parseVariant("int8={},{}".format(tmp_path / "q.pb", tmp_path / "q.pbtxt"))
+    with pytest.raises(FileNotFoundError, match="q.pb"):
+        loadDetectionModel(str(tmp_path), name, **files)
+    with pytest.raises(ValueError):
+        loadDetectionModel(str(tmp_path), name)
@@ -0,0 +1,99 @@
+# MotionController: motions end, stop the robot and report why, also when something fails
+
+import time
+
+import pytest
+
+from lib.motion import MotionController
+
+
+class FailingNetwork:
+    # odometry reads fail like a dropped DBus connection
+    def GetVariable(self, node, name):
+        raise RuntimeError("disconnected")
+
+
+class Speeds:
+    # set_speed stand-in, records every (left, right)
+    def __init__(self, fail_on=None):
+        self.targets = []
+        self.fail_on = fail_on
+
+    def __call__(self, left, right):
+        self.targets.append((left, right))
+        if (left, right) == self.fail_on:
+            raise RuntimeError("send failed")
+
+
+def test_deadline_stops_robot():
+    speeds = Speeds()
+    controller = MotionController(speeds, tick=0.001)
+    motion = controller.reverse(0.5, speed=250)  # 0.05s at 10cm/s
+
+    assert motion.wait(2)
+    assert motion.reason == "deadline" and motion.error is None
+    assert speeds.targets == [(-250, -250), (0, 0)]
+    assert motion.distance_cm == pytest.approx(0.5, abs=0.1)
+
+
+def test_odometry_error_stops_robot():
+    speeds = Speeds()
+    controller = MotionController(speeds, aseba_network=FailingNetwork(), tick=0.001)
+    motion = controller.reverse(10, odometry=True)
+
+    assert motion.wait(2)
+    assert motion.reason == "error" and isinstance(motion.error, RuntimeError)
+    assert speeds.targets[-1] == (0, 0)
+
+
+def test_deadline_ignores_wall_clock(monkeypatch):
+    # a wall clock that stands still (or was stepped back) must not keep the robot driving
+    monkeypatch.setattr(time, "time", lambda: 0.0)
+    speeds = Speeds()
+    controller = MotionController(speeds, tick=0.001)
+    motion = controller.drive(100, 100, duration=0.05)
+
+    assert motion.wait(2)
+    assert motion.reason == "deadline"
+    assert speeds.targets == [(100, 100), (0, 0)]
+
+
+def test_condition_error_stops_robot():
+    speeds = Speeds()
+    controller = MotionController(speeds, tick=0.001)
+    motion = controller.drive(100, 100, duration=5, until=lambda: 1 / 0)
+
+    assert motion.wait(2)
+    assert isinstance(motion.error, ZeroDivisionError)
+    assert speeds.targets == [(100, 100), (0, 0)]
+
+
+def test_set_speed_error_finishes_motion():
+    speeds = Speeds(fail_on=(100, 100))
+    controller = MotionController(speeds, tick=0.001)
+    motion = controller.drive(100, 100, duration=5)
+
+    assert motion.wait(2)
+    assert motion.reason == "error"
+    assert speeds.targets[-1] == (0, 0)
+
+
+def test_superseded_motion_keeps_motors_running():
+    speeds = Speeds()
+    controller = MotionController(speeds, tick=0.001)
+    first = controller.drive(100, 100, duration=5)
+    second = controller.drive(200, 200, duration=0.02)
+
+    assert first.wait(2) and first.reason == "superseded"
+    assert second.wait(2) and second.reason == "deadline"
+    assert speeds.targets == [(100, 100), (200, 200), (0, 0)]
+
+
+def test_cancel_stops_robot():
+    speeds = Speeds()
+    controller = MotionController(speeds, tick=0.001)
+    motion = controller.drive(100, 100)
+    controller.stop()
+
+    assert motion.done() and motion.reason == "cancelled"
+    assert speeds.targets[-1] == (0, 0)
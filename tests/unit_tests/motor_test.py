@@ -0,0 +1,137 @@
+# MotorChannel coalescing and error handling against scripted Aseba networks
+
+import threading
+import time
+
+from lib.motor import MotorChannel
+
+
+class HeldNetwork:
+    # records motor target variables and answers them only when release() is called
+    def __init__(self):
+        self.variables = []
+        self.handlers = []
+        self.sent = threading.Event()
+
+    @property
+    def targets(self):
+        return [(left[2], right[2]) for left, right in zip(self.variables[0::2], self.variables[1::2])]
+
+    def SetVariable(self, node, name, values, reply_handler, error_handler):
+        self.variables.append((node, name, values[0]))
+        self.handlers.append((reply_handler, error_handler))
+        if name == "motor.right.target":
+            self.sent.set()
+
+    def release(self, variables=2):
+        self.sent.clear()
+        for _ in range(variables):
+            reply_handler, error_handler = self.handlers.pop(0)
+            reply_handler()
+
+
+class RaisingNetwork:
+    # fails synchronously like a disconnected DBus proxy, then recovers
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.values = []
+
+    @property
+    def targets(self):
+        return list(zip(self.values[0::2], self.values[1::2]))
+
+    def SetVariable(self, node, name, values, reply_handler, error_handler):
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("disconnected")
+        self.values.append(values[0])
+        reply_handler()
+
+
+def test_coalesces_while_in_flight():
+    network = HeldNetwork()
+    channel = MotorChannel(network, timeout=5)
+    channel.start()
+
+    channel.send(100, 100)
+    assert network.sent.wait(1)
+    # the first target waits for its reply, newer ones replace each other
+    channel.send(200, 200)
+    channel.send(300, 300)
+    channel.send(300, 300)
+    network.release()
+    assert network.sent.wait(1)
+    network.release()
+
+    assert channel.flush(1)
+    assert network.targets == [(100, 100), (300, 300)]
+    assert (channel.coalesced, channel.dropped, channel.sent) == (1, 1, 2)
+
+    # a repeat of the target the robot already has isn't sent
+    channel.send(300, 300)
+    assert channel.dropped == 2
+    channel.stop()
+
+
+def test_sets_the_variables_of_its_node():
+    network = HeldNetwork()
+    channel = MotorChannel(network, node="thymio-2", timeout=5)
+    channel.start()
+
+    channel.send(100, -100)
+    assert network.sent.wait(1)
+    assert network.variables == [("thymio-2", "motor.left.target", 100), ("thymio-2", "motor.right.target", -100)]
+
+    # the command is only answered once both variables are
+    network.release(1)
+    assert not channel.flush(0.1)
+    network.release(1)
+    assert channel.flush(1)
+    assert channel.sent == 1
+    channel.stop()
+
+
+def test_raising_send_keeps_channel_alive():
+    network = RaisingNetwork()
+    channel = MotorChannel(network)
+    channel.start()
+
+    channel.send(500, 500)
+    assert channel.flush(1)
+    assert channel.errors == 1 and channel.thread.is_alive()
+
+    # the failed target is unknown to the robot, so sending it again isn't dropped
+    channel.send(500, 500)
+    assert channel.flush(1)
+    assert network.targets == [(500, 500)]
+    channel.stop()
+
+
+def test_error_reply_forgets_last_target():
+    network = HeldNetwork()
+    channel = MotorChannel(network)
+    channel.start()
+
+    channel.send(100, 100)
+    assert network.sent.wait(1)
+    reply_handler, error_handler = network.handlers.pop(0)
+    error_handler("no such node")
+    # the other variable's late reply belongs to a command that is already over
+    network.handlers.pop(0)[0]()
+
+    assert channel.flush(1)
+    assert channel.errors == 1 and channel.last_sent is None and channel.sent == 0
+    channel.stop()
+
+
+def test_stop_is_bounded_without_replies():
+    network = HeldNetwork()
+    channel = MotorChannel(network, timeout=60)
+    channel.start()
+
+    channel.send(100, 100)
+    assert network.sent.wait(1)
+    start = time.perf_counter()
+    channel.stop(timeout=0.2)
+    assert time.perf_counter() - start < 2
+    assert channel.thread is None
@@ -0,0 +1,41 @@
+# a compliance test recorded in the fake world replays to the compliance it measured
+
+import glob
+import os
+import threading
+import time
+
+import pytest
+
+from lib.fakes import FakeWorld
+from lib.trace import Trace
+from main import ThymPi
+from replay import replayTrace
+
+
+def test_record_replay_round_trip(tmp_path):
+    world = FakeWorld(speedup=4)
+    devices, _ = world.devices()
+    thympi = ThymPi(record_dir=str(tmp_path), load_model=False, verbose=False, compliances={}, startup_report=False,
+                    **devices)
+
+    # back away from the obstacle first, these samples are drained before the test and must not be recorded
+    thympi.setSpeed(-300, -300)
+    time.sleep(0.5)
+    try:
+        thympi.testCompliance("cup")
+    finally:
+        thympi.motor.stop()
+
+    path, = glob.glob(os.path.join(str(tmp_path), "cup-*.trace"))
+    trace = Trace(path)
+    assert trace.test_start is not None
+    # the trace starts with the calibration (at most 0.3s of trace time at speedup 4), not the drive before it
+    assert trace.test_start - trace.start < 0.4
+
+    threads = threading.active_count()
+    class_name, recorded, replayed = replayTrace(path)
+    assert class_name == "cup"
+    assert replayed == pytest.approx(recorded, abs=1e-6)
+    assert recorded == pytest.approx(thympi.compliances["cup"])
+    assert threading.active_count() <= threads
@@ -0,0 +1,70 @@
+# RollingWindow against brute force, FrameSegmenter against the legacy framed analysis it replaced
+
+import numpy as np
+import pytest
+
+from lib.segmenter import FrameSegmenter
+from lib.stats import RollingWindow
+
+
+def legacyFrames(xs, c, nf, fs):
+    # analyseFrames of tests/compliance_test.py before it used FrameSegmenter
+    a = []
+    d = []
+    for i in range(fs * 2, len(xs) + 1, fs):
+        v = sum(xs[i - fs:i]) / fs - c
+        if v > nf:
+            a.append(v)
+        elif v < -nf:
+            d.append(v)
+    return a, d
+
+
+@pytest.fixture
+def xs():
+    # noise with a drive-off, a collision and a bounce
+    rng = np.random.default_rng(1)
+    x = rng.normal(0.3, 0.5, 2000)
+    x[:80] += 2.0
+    x[700:790] -= 4.0
+    x[790:830] += 1.5
+    return x.tolist()
+
+
+@pytest.mark.parametrize("size", [1, 7, 50])
+def test_rolling_window_matches_brute_force(xs, size):
+    window = RollingWindow(size)
+    for i, x in enumerate(xs):
+        window.update(x)
+        last = xs[max(i + 1 - size, 0):i + 1]
+        assert window.length == len(last)
+        assert window.mean == pytest.approx(sum(last) / len(last))
+        assert (window.min, window.max) == (min(last), max(last))
+
+
+@pytest.mark.parametrize("frame_size", [25, 50, 64])
+def test_framed_matches_legacy_analysis(xs, frame_size):
+    c = 0.3
+    segmenter = FrameSegmenter(0.5, frame_size)
+    for x in xs:
+        segmenter.update(x - c)
+    segmenter.close()
+
+    accel_events, decel_events = legacyFrames(xs, c, 0.5, frame_size)
+    assert segmenter.accel_events == pytest.approx(accel_events)
+    assert segmenter.decel_events == pytest.approx(decel_events)
+
+
+def test_sliding_keeps_a_collision_in_one_event():
+    # a 60 sample collision straddles two 50 sample frames, framed analysis splits and dilutes it
+    xs = [0.0] * 120 + [-3.0] * 60 + [0.0] * 120
+    framed, sliding = FrameSegmenter(0.5), FrameSegmenter(0.5, sliding=True)
+    for x in xs:
+        framed.update(x)
+        sliding.update(x)
+    framed.close()
+
+    assert framed.decel_events == pytest.approx([-1.8, -1.8])
+    assert sliding.close() is None
+    assert sliding.decel_events == pytest.approx([-3.0])
+    assert sliding.accel_events == []
@@ -0,0 +1,118 @@
+# ComplianceStore round trips, in memory and on disk
+
+import contextlib
+import sqlite3
+import threading
+
+import pytest
+
+from lib.store import ComplianceStore
+
+
+@pytest.fixture(params=["memory", "file"])
+def path(request, tmp_path):
+    return ":memory:" if request.param == "memory" else str(tmp_path / "compliances.db")
+
+
+def test_round_trip(path):
+    store = ComplianceStore(path)
+    assert store["cup"] is None
+    assert "cup" not in store
+
+    store["cup"] = 0.5
+    store["cup"] = 0.7
+    store["book"] = 0.2
+
+    assert store["cup"] == pytest.approx(0.6)
+    assert store.get("teddy bear", 1.0) == 1.0
+    assert sorted(store) == ["book", "cup"]
+    assert store.summary("cup").count == 2
+    assert [compliance for timestamp, compliance in store.history("cup")] == [0.5, 0.7]
+    store.close()
+
+
+def test_close_persists_queued_writes(tmp_path):
+    path = str(tmp_path / "compliances.db")
+    store = ComplianceStore(path)
+    for compliance in (0.1, 0.2, 0.3):
+        store["cup"] = compliance
+    store.close()
+
+    connection = sqlite3.connect(path)
+    count, mean = connection.execute("SELECT count, mean FROM summary WHERE class_name = 'cup'").fetchone()
+    measurements = connection.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+    connection.close()
+    assert (count, measurements) == (3, 3)
+    assert mean == pytest.approx(0.2)
+
+    # a new store sees the summary, and a closed store can still be written to
+    reopened = ComplianceStore(path)
+    assert reopened["cup"] == pytest.approx(0.2)
+    reopened["cup"] = 0.6
+    reopened.close()
+    assert ComplianceStore(path).summary("cup").count == 4
+
+
+def test_close_is_idempotent():
+    store = ComplianceStore(":memory:")
+    store.close()
+    store["cup"] = 0.4
+    store.close()
+    store.close()
+    assert store.history("cup")[0][1] == 0.4
+
+
+def flushed(store, timeout=5):
+    # flush() without hanging the test run if it never returns
+    thread = threading.Thread(target=store.flush, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_failed_commit_keeps_writer(tmp_path, capsys):
+    store = ComplianceStore(str(tmp_path / "compliances.db"))
+    store.load()
+
+    # the first commit finds the database locked
+    connection = store.connection
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    @contextlib.contextmanager
+    def flaky():
+        if len(failures) > 0:
+            raise failures.pop()
+        with connection() as c:
+            yield c
+
+    store.connection = flaky
+    store["cup"] = 0.5
+    assert flushed(store)
+    store["cup"] = 0.7
+    assert flushed(store)
+
+    assert store.errors == 1 and "database is locked" in capsys.readouterr().out
+    assert [compliance for timestamp, compliance in store.history("cup")] == [0.7]
+    store.close()
+    assert ComplianceStore(store.path).summary("cup").count == 2
+
+
+def test_flush_and_close_restart_a_dead_writer(tmp_path):
+    store = ComplianceStore(str(tmp_path / "compliances.db"))
+    store["cup"] = 0.5
+    store.flush()
+
+    # the writer is gone with a measurement still queued behind it
+    store.writes.put(None)
+    store.writer.join()
+    store.writes.put(("book", 1, 0.3, 0.0, 0.3, 0.3, 0.3, 1.0))
+
+    assert flushed(store)
+    assert [compliance for timestamp, compliance in store.history("book")] == [0.3]
+
+    # close commits what is queued behind a dead writer too
+    store.writes.put(None)
+    store.writer.join()
+    store.writes.put(("teddy bear", 1, 0.8, 0.0, 0.8, 0.8, 0.8, 2.0))
+    store.close()
+    assert ComplianceStore(store.path).summary("teddy bear").count == 1
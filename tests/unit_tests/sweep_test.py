@@ -0,0 +1,57 @@
+# sweep.py scores against calcCompliance, and its noise floors as multiples of the calibration error range
+
+import numpy as np
+import pytest
+
+from lib import compliance
+from lib.trace import TraceWriter
+from sweep import currentMultiples, positionSums, sweepCompliances, traceSums
+
+
+@pytest.fixture
+def events():
+    rng = np.random.default_rng(0)
+    return [-np.abs(rng.normal(0, 3, size)) for size in (1, 3, 10, 11, 57, 200)]
+
+
+def test_position_sums_match_wavg(events):
+    # calcCompliance weighs the largest decelerations first
+    for event in events:
+        largest_first = np.sort(np.abs(event))[::-1]
+        assert positionSums(event) @ compliance.weights == pytest.approx(compliance.wAvg(largest_first))
+
+
+def test_sweep_matches_calc_compliance(events):
+    sums = np.stack([positionSums(event) for event in events] + [np.zeros(len(compliance.weights))])
+    max_wavgs = [1, compliance.maxWavg, 10]
+    compliances = sweepCompliances(sums[:, np.newaxis], compliance.weights[np.newaxis], max_wavgs)
+    assert compliances.shape == (len(events) + 1, 1, 1, 3)
+
+    # the current weights and maxWavg are calcCompliance, no decel event is full compliance
+    expected = [compliance.calcCompliance([], [event]) for event in events] + [1.0]
+    assert compliances[:, 0, 0, 1] == pytest.approx(expected)
+
+
+def test_noise_floors_are_multiples_of_the_error_range(tmp_path):
+    # calibrated at 0.4 +- 0.2, then a 1 m/s^2 deceleration
+    path = str(tmp_path / "cup.trace")
+    writer = TraceWriter(path, {"class_name": "cup"})
+    x = np.full(400, 0.4)
+    x[100:150] -= 1.0
+    writer.addAccel(np.arange(x.size) / 1000, x)
+    writer.close(c_mean=0.4, c_error=0.2)
+
+    # noise floors 0.2 and 0.6 m/s^2 see it, 1.2 m/s^2 doesn't
+    class_name, calibration, sums = traceSums(path, [1, 3, 6])
+    assert (class_name, calibration) == ("cup", (0.4, 0.2))
+    # every value of the event is 1, so its position sums add up to 1
+    assert sums[0].sum() == pytest.approx(1.0)
+    assert sums[1] == pytest.approx(sums[0])
+    assert not sums[2].any()
+
+
+def test_current_multiples():
+    # 2 * (c_error - c_mean) / c_error, negative when the mean is larger than the error range
+    multiples = currentMultiples([(0.1, 0.2), (0.37, 0.2), (0.0, 0.0)])
+    assert multiples[:2] == pytest.approx([1.0, -1.7])
+    assert np.isnan(multiples[2])